@@ -0,0 +1,45 @@
+from django.db import transaction
+
+# (model, legacy string column, foreign key) of the User references converted in migration 0017
+USER_REFERENCES = [
+    ('User', 'referral_id_legacy', 'referral'),
+    ('PrimaryRewardPoint', 'referred_by_legacy', 'referred_by'),
+    ('PrimaryRewardPoint', 'new_user_legacy', 'new_user'),
+    ('PRPMatching', 'matching_user1_legacy', 'matching_user1'),
+    ('PRPMatching', 'matching_user2_legacy', 'matching_user2'),
+    ('SecondaryRewardPoint', 'referred_su1_legacy', 'referred_su1'),
+    ('SecondaryRewardPoint', 'referred_su2_legacy', 'referred_su2'),
+]
+
+
+def backfill_user_references(apps, batch_size=1000, log=None):
+    # Copy the legacy string pks into the foreign keys in pk order, one transaction per batch. Rows whose foreign
+    # key is already set are skipped, so an interrupted run resumes where it stopped when started again.
+    # Values that are not the pk of an existing user leave the foreign key empty.
+    # Returns {(model, field): (rows set, rows left unresolved)}.
+    user_model = apps.get_model('api', 'User')
+    results = {}
+    for model_name, legacy_field, field in USER_REFERENCES:
+        model = apps.get_model('api', model_name)
+        rows = model.objects.filter(**{f'{field}__isnull': True, f'{legacy_field}__isnull': False}) \
+            .exclude(**{legacy_field: ''}).order_by('pk')
+        last_pk = None
+        updated = unresolved = 0
+        while True:
+            batch = rows.filter(pk__gt=last_pk) if last_pk is not None else rows
+            batch = list(batch.values_list('pk', legacy_field)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            user_ids = {pk: int(value) for pk, value in batch if value.strip().isdigit()}
+            existing = set(user_model.objects.filter(pk__in=set(user_ids.values())).values_list('pk', flat=True))
+            objs = [model(pk=pk, **{f'{field}_id': user_id}) for pk, user_id in user_ids.items()
+                    if user_id in existing]
+            with transaction.atomic():
+                model.objects.bulk_update(objs, [field])
+            updated += len(objs)
+            unresolved += len(batch) - len(objs)
+            if log:
+                log(f'{model_name}.{field}: {updated} set, {unresolved} unresolved (up to pk {last_pk})')
+        results[(model_name, field)] = (updated, unresolved)
+    return results
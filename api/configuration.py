@@ -0,0 +1,71 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Every process keeps the Configuration table in memory and reloads it when the version stamp in the shared
+# cache changes (bumped by Configuration.save/delete) or after CONFIGURATION_CACHE_TTL seconds as a fallback
+# for changes made with queryset updates.
+VERSION_KEY = 'configuration:version'
+
+_lock = threading.Lock()
+_state = {'version': None, 'loaded_at': None, 'values': {}, 'decimal_values': {}}
+
+
+def version_cache():
+    return caches[getattr(settings, 'CONFIGURATION_CACHE', 'default')]
+
+
+def bump_configuration_version():
+    # a new random stamp instead of incr, which is a read and a write on the file based cache. Any stamp other
+    # than the one a process loaded makes it reload.
+    version_cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+    _state['loaded_at'] = None
+
+
+def _load():
+    from api.models import Configuration
+
+    version = version_cache().get(VERSION_KEY)
+    values, decimal_values = {}, {}
+    for name, value, decimal_value in Configuration.objects.order_by('pk') \
+            .values_list('config_name', 'value', 'decimal_value'):
+        values[name] = value
+        decimal_values[name] = decimal_value
+    _state.update(version=version, loaded_at=time.monotonic(), values=values, decimal_values=decimal_values)
+
+
+def _configuration():
+    ttl = getattr(settings, 'CONFIGURATION_CACHE_TTL', 300)
+    loaded_at = _state['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > ttl or version_cache().get(VERSION_KEY) != _state['version']:
+        with _lock:
+            _load()
+    return _state
+
+
+def config_value(name, default=0):
+    return _configuration()['values'].get(name, default)
+
+
+def config_decimal(name):
+    return _configuration()['decimal_values'][name]
+
+
+def reward_points():
+    # PRP, SRP and IRP reward point values
+    values = _configuration()['values']
+    return int(values.get('PRP', 0)), int(values.get('SRP', 0)), int(values.get('IRP', 0))
+
+
+def rpc_values():
+    # RPC1, RPC2, ... reward criteria in the order they were configured
+    return {name: int(value) for name, value in _configuration()['values'].items() if name.startswith('RPC')}
+
+
+def payout_rates():
+    # TDS, rental and repurchase rates as decimals
+    decimal_values = _configuration()['decimal_values']
+    return decimal_values['TDS'], decimal_values['RTL'], decimal_values['RPS']
@@ -1,21 +1,20 @@
-from api.models import User
-from api.reports import payout_report, referral_report
+from django.conf import settings
+from django.core.cache import caches
+
+from api.reports import bulk_payout_report, refresh_referral_reports
 
 
 def payout_report_cron():
-    user = User.objects.all()
-    for user in user:
-        payout_report(user)
+    return bulk_payout_report()
 
 
-def referral_report_cron(user=None):
+def referral_report_cron(full=False):
+    return refresh_referral_reports(full=full)
 
-    # users = User.objects.all()
-    # for user in users:
-    #     referrals = User.objects.filter(referral_id=user.pk)     # uncomment this when this function moved to cron
-    #     for user in referrals:
-    #         referral_report(user)
 
-    referrals = User.objects.filter(referral_id=user.pk, order_complete=True)
-    for user in referrals:
-        referral_report(user)
+def delete_expired_cache_entries():
+    # caches that never cull (core.cache.UnculledFileBasedCache) only drop entries nobody reads again here
+    for alias in settings.CACHES:
+        cache = caches[alias]
+        if hasattr(cache, 'delete_expired'):
+            cache.delete_expired()
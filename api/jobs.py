@@ -0,0 +1,116 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Job, User
+
+logger = logging.getLogger(__name__)
+
+# Jobs of a queue run strictly one after the other in id order: a worker only ever claims the head of a queue,
+# and a failed head is retried with backoff before anything behind it runs. Jobs whose worker died are claimed
+# again once JOB_LOCK_TIMEOUT has passed. Workers are `manage.py process_jobs` or the run_pending_jobs cron.
+JOB_HANDLERS = {}
+
+
+def job_handler(name, queue='default'):
+    def register(func):
+        JOB_HANDLERS[name] = (func, queue)
+        return func
+
+    return register
+
+
+def enqueue_job(name, key, **payload):
+    job, _ = Job.objects.get_or_create(key=key, defaults={'name': name, 'queue': JOB_HANDLERS[name][1],
+                                                          'payload': payload})
+    return job
+
+
+def claim_next_job(queue):
+    now = timezone.now()
+    lock_timeout = timedelta(seconds=getattr(settings, 'JOB_LOCK_TIMEOUT', 300))
+    with transaction.atomic():
+        job = Job.objects.select_for_update().filter(queue=queue, status__in=['pending', 'running']) \
+            .order_by('pk').first()
+        if job is None or job.run_after > now:
+            return None
+        if job.status == 'running' and job.locked_at and job.locked_at > now - lock_timeout:
+            return None  # still being processed by another worker
+        job.status = 'running'
+        job.locked_at = now
+        job.attempts += 1
+        job.save(update_fields=['status', 'locked_at', 'attempts'])
+    return job
+
+
+class JobLost(Exception):
+    pass
+
+
+def owned(job):
+    # the job as long as this worker holds it, a worker that claimed it again after JOB_LOCK_TIMEOUT bumped attempts
+    return Job.objects.filter(pk=job.pk, status='running', attempts=job.attempts)
+
+
+def run_job(job):
+    func, _ = JOB_HANDLERS[job.name]
+    try:
+        # the handler's writes and the job's completion commit together, a crash in between re-runs the whole job.
+        # A worker that lost the job to another one rolls its writes back, only the owner's are committed.
+        with transaction.atomic():
+            func(**job.payload)
+            if not owned(job).update(status='done', finished_at=timezone.now(), last_error=""):
+                raise JobLost
+    except JobLost:
+        logger.warning('Job %s ran longer than JOB_LOCK_TIMEOUT and was claimed by another worker, '
+                       'its writes were rolled back', job.key)
+        return False
+    except Exception:
+        max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+        failed = job.attempts >= max_attempts
+        owned(job).update(
+            status='failed' if failed else 'pending',
+            run_after=timezone.now() + timedelta(seconds=10 * 2 ** job.attempts),
+            last_error=traceback.format_exc())
+        logger.exception('Job %s failed (attempt %d of %d)', job.key, job.attempts, max_attempts)
+        return False
+    return True
+
+
+def run_pending_jobs(queues=None, limit=None):
+    # drain the given queues (all registered ones by default) and return the number of jobs run
+    queues = queues or sorted({queue for _, queue in JOB_HANDLERS.values()})
+    processed = 0
+    while limit is None or processed < limit:
+        ran = False
+        for queue in queues:
+            job = claim_next_job(queue)
+            if job is not None:
+                run_job(job)
+                processed += 1
+                ran = True
+        if not ran:
+            break
+    return processed
+
+
+def work(queues=None, sleep=1.0):
+    while True:
+        if not run_pending_jobs(queues):
+            time.sleep(sleep)
+
+
+@job_handler('reward_matching', queue='rewards')
+def reward_matching_job(user_id):
+    from api.serializers import reward_matching
+
+    reward_matching(User.objects.get(pk=user_id))
+
+
+def enqueue_reward_matching(order):
+    return enqueue_job('reward_matching', f'reward_matching:{order.pk}', user_id=order.user_id)
@@ -0,0 +1,20 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from api.backfills import backfill_user_references
+
+
+class Command(BaseCommand):
+    help = 'Fill the User foreign keys added in migration 0017 from their legacy string columns. Run it between ' \
+           '`migrate api 0017` and `migrate`, migration 0018 then only fills the remaining rows. Safe to stop ' \
+           'and run again, rows that are already filled are skipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--quiet', action='store_true', help='Only print the summary.')
+
+    def handle(self, *args, **options):
+        log = None if options['quiet'] else self.stdout.write
+        results = backfill_user_references(apps, options['batch_size'], log)
+        for (model_name, field), (updated, unresolved) in results.items():
+            self.stdout.write(f'{model_name}.{field}: {updated} rows set, {unresolved} values not matching a user')
@@ -0,0 +1,96 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.utils import load_backend
+
+from api.management.commands.benchmark_endpoints import percentile
+
+# (mode, ENGINE, CONN_MAX_AGE), a request cycle is what the request_started / request_finished handlers and a
+# cheap view do: close_if_unusable_or_obsolete, one query, close_if_unusable_or_obsolete
+MODES = [
+    ('new', 'django.db.backends.postgresql', 0),
+    ('persistent', 'django.db.backends.postgresql', 600),
+    ('pooled', 'core.db.backends.postgresql_pool', 0),
+]
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of opening a PostgreSQL connection for every request against persistent ' \
+           '(CONN_MAX_AGE) and pooled (core.db.backends.postgresql_pool) connections, using the default database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Request cycles per thread.')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--query', default='SELECT 1')
+        parser.add_argument('--mode', action='append', dest='modes', choices=[mode for mode, _, _ in MODES])
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'postgresql':
+            raise CommandError('The default database is not PostgreSQL')
+        opened = []
+
+        def count(sender, connection, **kwargs):
+            if connection.alias.startswith('benchmark_'):
+                opened.append(connection.alias)
+
+        connection_created.connect(count)
+        results = {}
+        for mode, engine, conn_max_age in MODES:
+            if options['modes'] and mode not in options['modes']:
+                continue
+            settings_dict = {**connections['default'].settings_dict, 'ENGINE': engine, 'CONN_MAX_AGE': conn_max_age,
+                             'POOL': {**connections['default'].settings_dict.get('POOL', {}),
+                                      'MAX_SIZE': options['threads']}}
+            alias = f'benchmark_{mode}'
+            timings = []
+            pools = []
+            lock = threading.Lock()
+
+            def run():
+                wrapper = load_backend(engine).DatabaseWrapper(settings_dict, alias)
+                local = []
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    wrapper.close_if_unusable_or_obsolete()
+                    with wrapper.cursor() as cursor:
+                        cursor.execute(options['query'])
+                        cursor.fetchall()
+                    wrapper.close_if_unusable_or_obsolete()
+                    local.append((time.perf_counter() - started) * 1000)
+                wrapper.close()
+                with lock:
+                    timings.extend(local)
+                    if hasattr(wrapper, 'pool'):
+                        pools.append(wrapper.pool())
+
+            del opened[:]
+            threads = [threading.Thread(target=run) for _ in range(options['threads'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            if len(timings) != options['requests'] * options['threads']:
+                raise CommandError(f'{mode}: a thread failed, see the traceback above')
+            # connection_created fires for every checkout of the pooled backend, the pool counts real connects
+            connects = len(opened)
+            if pools:
+                connects = pools[0].stats()['opened']
+                pools[0].close_idle()
+            results[mode] = statistics.mean(timings)
+            self.stdout.write(f'{mode:11} mean {results[mode]:7.2f} ms  p50 {percentile(timings, 50):7.2f} ms  '
+                              f'p95 {percentile(timings, 95):7.2f} ms  {len(timings) / elapsed:8.0f} req/s  '
+                              f'{connects} connects')
+        connection_created.disconnect(count)
+
+        if 'new' in results:
+            for mode, mean in results.items():
+                if mode != 'new':
+                    self.stdout.write(self.style.SUCCESS(
+                        f'{mode} saves {results["new"] - mean:.2f} ms per request over a new connection'))
@@ -0,0 +1,205 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.cron import payout_report_cron
+from api.models import User, Order, PrimaryRewardPoint
+
+
+def order_payload():
+    return {
+        'order_items': [{'description': 'T-shirt', 'price': '2208.00', 'tax': '125.00', 'quantity': 1, 'size': 'M'}],
+        'shipping_address': {'address_line1': '1 Main Road', 'address_line2': 'Anna Nagar', 'landmark': 'Bus stand',
+                             'city': 'Chennai', 'pincode': '600001'},
+        'total_amount': '2208.00',
+        'total_tax': '125.00',
+        'payment_status': 'completed',
+        'payment_method': 'upi',
+        'order_complete': True,
+    }
+
+
+def benchmark_cases(sample):
+    today = timezone.now().date()
+    period = {'start_date': str(today - timedelta(days=30)), 'end_date': str(today)}
+    # (name, request or callable, caller, roll back the writes after every iteration)
+    return [
+        ('GET /dashboard-statistics/', ('get', '/dashboard-statistics/', None), sample['user'], False),
+        ('GET /dashboard-statistics/ (org)', ('get', '/dashboard-statistics/', None), None, False),
+        ('POST /team-details/', ('post', '/team-details/', None), sample['user'], False),
+        ('GET /team-details-tree/', ('get', '/team-details-tree/', None), sample['user'], False),
+        ('POST /payout-report/', ('post', '/payout-report/', period), sample['user'], False),
+        ('POST /payout-report/ (org)', ('post', '/payout-report/', {**period, 'is_org': True}), sample['admin'],
+         False),
+        ('GET /referral-report/', ('get', '/referral-report/', None), sample['user'], False),
+        ('POST /create-order/', ('post', '/create-order/', order_payload()), sample['new_user'], True),
+        ('payout_report_cron', payout_report_cron, None, True),
+    ]
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(percent / 100 * (len(values) - 1)))]
+
+
+def summarize(timings, query_counts):
+    return {
+        'iterations': len(timings),
+        'mean_ms': round(statistics.mean(timings), 2),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': max(query_counts),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Measure latency and query counts of the report endpoints, order creation and payout_report_cron ' \
+           'against the current database (fill it with manage.py generate_data). Results are saved as JSON and ' \
+           'compared with the previous run on a dataset of the same size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10)
+        parser.add_argument('--warmup', type=int, default=1, help='Unmeasured runs per case, they fill the '
+                                                                   'caches and report snapshots.')
+        parser.add_argument('--case', action='append', dest='cases', help='Only run cases containing this text.')
+        parser.add_argument('--user', help='Primary key of the user the endpoints are called as, defaults to '
+                                           'the user with the most direct referrals.')
+        parser.add_argument('--label', default='', help='Stored with the results, e.g. the branch name.')
+        parser.add_argument('--results-dir', default=str(Path(settings.BASE_DIR) / 'benchmark_results'))
+        parser.add_argument('--compare', help='Results file to compare with, defaults to the latest run on the '
+                                              'same database vendor and number of users.')
+        parser.add_argument('--threshold', type=float, default=25,
+                            help='Percent a p50 may grow before it is reported as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--no-save', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+        sample = self.sample(options['user'])
+        dataset = {
+            'users': User.objects.count(),
+            'orders': Order.objects.count(),
+            'primary_reward_points': PrimaryRewardPoint.objects.count(),
+            'sample_user': str(sample['user'].pk),
+            'sample_team': User.objects.filter(referral=sample['user']).count(),
+        }
+        self.stdout.write(f"{connection.vendor}, {dataset['users']} users, {dataset['orders']} orders, "
+                          f"sample user {dataset['sample_user']} with {dataset['sample_team']} referrals")
+
+        results = {}
+        for name, target, caller, rollback in benchmark_cases(sample):
+            if options['cases'] and not any(case in name for case in options['cases']):
+                continue
+            call = self.request(target, caller) if isinstance(target, tuple) else target
+            try:
+                for _ in range(options['warmup']):
+                    self.measure(call, rollback)
+                runs = [self.measure(call, rollback) for _ in range(options['iterations'])]
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'{name:36} failed: {type(e).__name__}: {e}'))
+                results[name] = {'error': f'{type(e).__name__}: {e}'}
+                continue
+            results[name] = summarize([elapsed for elapsed, _ in runs], [queries for _, queries in runs])
+            result = results[name]
+            self.stdout.write(f"{name:36} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+                              f"max {result['max_ms']:9.2f} ms  {result['queries']:5} queries")
+
+        run = {
+            'created_at': timezone.now().isoformat(),
+            'label': options['label'],
+            'vendor': connection.vendor,
+            'dataset': dataset,
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        results_dir = Path(options['results_dir'])
+        previous = self.previous_run(results_dir, run, options['compare'])
+        if not options['no_save']:
+            results_dir.mkdir(parents=True, exist_ok=True)
+            path = results_dir / f"{timezone.now():%Y%m%d-%H%M%S}-{connection.vendor}-{dataset['users']}.json"
+            path.write_text(json.dumps(run, indent=2))
+            self.stdout.write(f'Saved {path}')
+
+        if previous is not None:
+            regressions = self.compare(previous, run, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} regressions: {", ".join(regressions)}')
+
+    def sample(self, user_id):
+        if user_id:
+            user = User.objects.filter(pk=user_id).first()
+            if user is None:
+                raise CommandError(f'No user {user_id}')
+        else:
+            top = User.objects.exclude(referral=None).values('referral_id').annotate(total=Count('pk')) \
+                .order_by('-total', 'referral_id').first()
+            if top is None:
+                raise CommandError('No referrals in the database, load some data first (manage.py generate_data)')
+            user = User.objects.get(pk=top['referral_id'])
+        # orders are only created for users without one, the order rows are rolled back after every run
+        new_user = User.objects.filter(order_complete=False).exclude(referral=None).order_by('pk').first()
+        admin = User.objects.filter(is_admin=True).order_by('pk').first()
+        if new_user is None or admin is None:
+            raise CommandError('The database needs a referred user without an order and an admin user')
+        return {'user': user, 'new_user': new_user, 'admin': admin}
+
+    def request(self, target, caller):
+        method, path, data = target
+        client = APIClient()
+        if caller is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(caller).access_token}')
+
+        def call():
+            response = getattr(client, method)(path, data, format='json')
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {path} returned {response.status_code}')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response
+
+        return call
+
+    def measure(self, call, rollback):
+        with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            call()
+            elapsed = (time.perf_counter() - started) * 1000
+            transaction.set_rollback(rollback)
+        return elapsed, len(queries.captured_queries)
+
+    def previous_run(self, results_dir, run, compare):
+        if compare:
+            return json.loads(Path(compare).read_text())
+        candidates = sorted(results_dir.glob(f"*-{run['vendor']}-{run['dataset']['users']}.json"))
+        return json.loads(candidates[-1].read_text()) if candidates else None
+
+    def compare(self, previous, run, threshold):
+        self.stdout.write(f"\nCompared with {previous['created_at']} {previous.get('label', '')}".rstrip())
+        regressions = []
+        for name, result in run['results'].items():
+            before = previous['results'].get(name)
+            if not before or 'error' in before or 'error' in result:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            queries = result['queries'] - before['queries']
+            line = f"{name:36} p50 {before['p50_ms']:9.2f} -> {result['p50_ms']:9.2f} ms ({change:+6.1f}%)  " \
+                   f"queries {before['queries']} -> {result['queries']}"
+            if change > threshold or queries > 0:
+                regressions.append(name)
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+        return regressions
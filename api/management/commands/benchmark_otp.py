@@ -0,0 +1,65 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from api.models import User, SMSOutbox
+
+
+class Command(BaseCommand):
+    help = 'Measure OTP generation latency (p50/p99) under concurrent requests. Run `manage.py sms_stub_gateway` ' \
+           'and `manage.py send_sms` next to it to include delivery.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=100, help='Requests sent by each worker.')
+        parser.add_argument('--users', type=int, default=50, help='Distinct mobile numbers to request OTPs for.')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated users and outbox rows.')
+
+    def handle(self, *args, **options):
+        url = reverse('generate_otp')
+        mobile_numbers = [f'+916{number:09d}' for number in range(options['users'])]
+        latencies = []
+        statuses = []
+        lock = threading.Lock()
+        first_sms = SMSOutbox.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+        def worker(index):
+            client = Client()
+            try:
+                for i in range(options['requests']):
+                    mobile_number = mobile_numbers[(index * options['requests'] + i) % len(mobile_numbers)]
+                    started = time.perf_counter()
+                    response = client.post(url, {'mobile_number': mobile_number}, content_type='application/json')
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        self.stdout.write(f'{len(latencies)} requests in {wall:.2f}s ({len(latencies) / wall:.0f} req/sec), '
+                          f'{sum(status != 200 for status in statuses)} errors')
+        self.stdout.write(f'p50 {statistics.median(latencies) * 1000:.1f}ms  '
+                          f'p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f}ms  '
+                          f'max {latencies[-1] * 1000:.1f}ms')
+        outbox = SMSOutbox.objects.filter(pk__gt=first_sms)
+        self.stdout.write(f'outbox: {outbox.filter(status="sent").count()} sent, '
+                          f'{outbox.exclude(status="sent").count()} not sent yet')
+
+        if not options['keep']:
+            outbox.delete()
+            User.objects.filter(mobile_number__in=mobile_numbers).delete()
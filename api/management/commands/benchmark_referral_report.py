@@ -0,0 +1,104 @@
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.models import PrimaryRewardPoint, User
+from api.reports import referral_report
+from api.utils import get_last_saturday
+
+
+def legacy_referral_report(user):
+    # referral_report before the grouped count and linear carry forward, kept to check the output against
+    start_date = get_last_saturday()
+    end_date = start_date + timedelta(days=6, hours=23, minutes=59)
+    referrals = User.objects.filter(referral_id=user.pk)
+
+    user_sales = defaultdict(int)
+
+    for referral in referrals:
+        total_sales = PrimaryRewardPoint.objects.filter(date__range=(start_date, end_date),
+                                                        referred_by=referral.pk).count()
+        user_sales[referral.pk] += total_sales
+
+    report = []
+    matched_users = set()
+
+    for referral in referrals:
+        user_id = referral.pk
+        if user_id in matched_users:
+            continue
+
+        total_sales = user_sales[user_id]
+
+        data = {
+            'user_id': user_id,
+            'name': referral.full_name,
+            'mobile_number': referral.mobile_number.national_number,
+            'total_sales': total_sales,
+            'sales_consider': total_sales,
+            'sales_carry_forwarded': 0,
+        }
+
+        for other_referral in referrals:
+            other_user_id = other_referral.pk
+            if user_id != other_user_id and user_sales[other_user_id] > 0:
+                carry_forwarded = min(total_sales, user_sales[other_user_id])
+                data['sales_consider'] -= carry_forwarded
+                data['sales_carry_forwarded'] += carry_forwarded
+                matched_users.add(other_user_id)
+                user_sales[other_user_id] -= carry_forwarded
+
+        report.append(data)
+        matched_users.add(user_id)
+
+    return report
+
+
+class Command(BaseCommand):
+    help = 'Time referral_report for a user with many direct referrals and check it against the legacy version.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--referrals', type=int, default=10000)
+        parser.add_argument('--selling', type=float, default=0.3, help='Fraction of referrals with sales this week.')
+        parser.add_argument('--skip-legacy', action='store_true', help='Only time the current implementation.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        referrer = User.objects.create(mobile_number='+915000000000', full_name='benchmark referrer')
+        referrer = User.objects.get(pk=referrer.pk)
+        base_pk = 5 * 10 ** 14
+        try:
+            referrals = [User(pk=base_pk + i, mobile_number=f'+915{i:09d}', full_name=f'referral {i}',
+                              referral=referrer, referral_path=f'{referrer.referral_path}{base_pk + i}/',
+                              referral_depth=referrer.referral_depth + 1)
+                         for i in range(1, options['referrals'] + 1)]
+            User.objects.bulk_create(referrals, batch_size=1000)
+            sales = [PrimaryRewardPoint(PRP_user=referrer, referred_by=referral, matching_count=2)
+                     for referral in referrals if rng.random() < options['selling']
+                     for _ in range(rng.randint(1, 5))]
+            PrimaryRewardPoint.objects.bulk_create(sales, batch_size=1000)
+            self.stdout.write(f'{len(referrals)} referrals, {len(sales)} PRP rows this week')
+
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                report = referral_report(referrer)
+            self.stdout.write(f'referral_report: {time.perf_counter() - started:.3f}s, '
+                              f'{len(queries.captured_queries)} queries, {len(report)} rows')
+
+            if not options['skip_legacy']:
+                started = time.perf_counter()
+                legacy = legacy_referral_report(referrer)
+                self.stdout.write(f'legacy referral_report: {time.perf_counter() - started:.3f}s')
+                if legacy != report:
+                    raise CommandError('referral_report output differs from the legacy implementation')
+                self.stdout.write(self.style.SUCCESS('Output identical.'))
+        finally:
+            PrimaryRewardPoint.objects.filter(PRP_user=referrer).delete()
+            User.objects.filter(referral=referrer).delete()
+            referrer.delete()
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.query_plans import explain_queries, report_cases, sample_data
+
+
+class Command(BaseCommand):
+    help = 'Run every query of api/reports.py and api/utils.py against the database, EXPLAIN it and fail when a ' \
+           'large table is read with a sequential scan. Needs a database with representative data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case', action='append', dest='cases', help='Only check cases containing this text.')
+        parser.add_argument('--show-plans', action='store_true')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError(f'EXPLAIN is not supported for {connection.vendor}')
+        sample = sample_data()
+        if sample is None:
+            raise CommandError('No referrals in the database, load some data first (manage.py generate_data)')
+
+        failures = []
+        for name, call, full_scans in report_cases(sample):
+            if options['cases'] and not any(case in name for case in options['cases']):
+                continue
+            explained, error = explain_queries(call, full_scans)
+            if error is not None:
+                self.stdout.write(self.style.WARNING(f'{name} raised {type(error).__name__}: {error}'))
+
+            problems = [(tables, sql, plan) for sql, plan, tables in explained if tables]
+            if problems:
+                self.stdout.write(self.style.ERROR(f'FAIL {name}'))
+                for tables, sql, plan in problems:
+                    self.stdout.write(f'  seq scan on {", ".join(tables)}:\n  {sql}')
+                    if options['show_plans']:
+                        self.stdout.write(plan)
+                failures.append(name)
+            else:
+                if options['show_plans']:
+                    for sql, plan, _ in explained:
+                        self.stdout.write(f'{sql}\n{plan}\n')
+                self.stdout.write(f'ok   {name} ({len(explained)} queries)')
+
+        if failures:
+            raise CommandError(f'{len(failures)} cases read large tables with sequential scans')
+        self.stdout.write(self.style.SUCCESS('No unexpected sequential scans.'))
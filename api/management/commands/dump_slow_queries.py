@@ -0,0 +1,37 @@
+import json
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+
+from api.slow_queries import recent_slow_queries, clear_slow_queries
+
+
+class Command(BaseCommand):
+    help = 'Print the slow queries recorded by api.slow_queries, newest first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--view', help='Only queries of this view, e.g. TeamDetailsView.')
+        parser.add_argument('--json', action='store_true', help='One JSON object per line.')
+        parser.add_argument('--clear', action='store_true', help='Empty the buffer after printing it.')
+
+    def handle(self, *args, **options):
+        entries = [entry for entry in recent_slow_queries() if not options['view'] or entry['view'] == options['view']]
+        for entry in entries[:options['limit']]:
+            if options['json']:
+                self.stdout.write(json.dumps(entry))
+                continue
+            recorded_at = datetime.fromtimestamp(entry['recorded_at'], timezone.utc)
+            self.stdout.write(self.style.WARNING(
+                f"{recorded_at:%Y-%m-%d %H:%M:%S} {entry['duration_ms']:.1f} ms {entry['view']} "
+                f"({entry['call_site'] or 'no api/ frame'})"))
+            self.stdout.write(entry['sql'])
+            if entry['params'] is not None:
+                self.stdout.write(f"params: {entry['params']}")
+            if entry['plan']:
+                self.stdout.write(entry['plan'])
+            self.stdout.write('')
+        if not options['json']:
+            self.stdout.write(f'{min(len(entries), options["limit"])} of {len(entries)} slow queries')
+        if options['clear']:
+            clear_slow_queries()
@@ -0,0 +1,266 @@
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api.models import User, Configuration, Address, Order, OrderItem, PrimaryRewardPoint, PRPMatching, \
+    SecondaryRewardPoint, SpotRewardPoint
+from api.utils import allocate_invoice_numbers
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+# percentages, Configuration.save stores value / 100 as decimal_value
+CONFIGURATION_DEFAULTS = {
+    'TDS': 5, 'RTL': 10, 'RPS': 10,
+    'PRP': 2000, 'SRP': 1000, 'IRP': 500,
+    'RPC1': 4000, 'RPC2': 10000, 'RPC3': 20000,
+}
+
+ORDER_PRICE = Decimal('2208.00')
+ORDER_TAX = Decimal('125.00')
+CITIES = ['Chennai', 'Coimbatore', 'Madurai', 'Bengaluru', 'Hyderabad', 'Kochi', 'Mumbai', 'Pune']
+
+
+@contextmanager
+def explicit_dates(*fields):
+    # bulk_create fills auto_now_add fields with the current time, the generated rows carry their own dates
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic referral tree with orders, reward points and Configuration rows for benchmarks ' \
+           '(manage.py benchmark_endpoints) and query plan checks. Runs on SQLite and PostgreSQL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=SIZES, default='1k')
+        parser.add_argument('--users', type=int, help='Number of users, overrides --size.')
+        parser.add_argument('--fan-out', type=int, default=4, help='Most direct referrals per user.')
+        parser.add_argument('--depth', type=int, default=12, help='Deepest referral level, a new tree is '
+                                                                  'started when every branch reached it.')
+        parser.add_argument('--weeks', type=int, default=26, help='Weeks the join and order dates spread over.')
+        parser.add_argument('--order-rate', type=float, default=0.7, help='Share of users with a completed order.')
+        parser.add_argument('--mobile-start', type=int, default=6000000000,
+                            help='First national mobile number, numbers count up from it.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--flush', action='store_true', help='Empty the database first (manage.py flush).')
+        parser.add_argument('--skip-counters', action='store_true',
+                            help='Do not rebuild the reward counters afterwards.')
+
+    def handle(self, *args, **options):
+        total = options['users'] or SIZES[options['size']]
+        if total < 1 or options['fan_out'] < 1 or options['depth'] < 1:
+            raise CommandError('--users, --fan-out and --depth must be positive')
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+
+        first_mobile = options['mobile_start']
+        if User.objects.filter(mobile_number__in=[f'+91{first_mobile}', f'+91{first_mobile + total - 1}']).exists():
+            raise CommandError(f'Users with mobile numbers from {first_mobile} already exist, '
+                               f'pass --flush or another --mobile-start')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.created = {}
+        self.ensure_configuration()
+        started = time.monotonic()
+        now = timezone.now()
+        self.first_joined = now - timedelta(weeks=options['weeks'])
+        self.span = (now - self.first_joined).total_seconds()
+
+        with explicit_dates(Order._meta.get_field('date_of_transaction'),
+                            PrimaryRewardPoint._meta.get_field('date'),
+                            SecondaryRewardPoint._meta.get_field('date'),
+                            SpotRewardPoint._meta.get_field('date')):
+            users = self.generate_users(total, first_mobile, options)
+            self.generate_rewards(users)
+
+        # explicit primary keys do not move the PostgreSQL sequences along
+        sql = connection.ops.sequence_reset_sql(no_style(), [Address, Order, OrderItem, PrimaryRewardPoint,
+                                                             PRPMatching, SecondaryRewardPoint, SpotRewardPoint])
+        with connection.cursor() as cursor:
+            for statement in sql:
+                cursor.execute(statement)
+
+        if not options['skip_counters']:
+            call_command('rebuild_reward_counters', verbosity=0)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {total} users in {time.monotonic() - started:.1f}s: ' +
+            ', '.join(f'{model.__name__} {count}' for model, count in self.created.items())))
+
+    def ensure_configuration(self):
+        existing = set(Configuration.objects.values_list('config_name', flat=True))
+        for name, value in CONFIGURATION_DEFAULTS.items():
+            if name not in existing:
+                Configuration(config_name=name, value=value).save()
+
+    def joined_at(self, index, total):
+        return self.first_joined + timedelta(seconds=self.span * index / total)
+
+    def generate_users(self, total, first_mobile, options):
+        # Breadth first, every user refers 1..fan_out users until the depth limit, so users join after their
+        # referrer. Returns (pk, referral pk, ordered_at or None) per user in join order for the reward rows.
+        users = []
+        queue = []
+        batch = []
+        address_id, order_id, item_id = next_id(Address), next_id(Order), next_id(OrderItem)
+
+        def add_user(parent):
+            index = len(users)
+            national = first_mobile + index
+            pk = int(f'{national}1')  # the same shape as generate_user_id
+            path = f"{parent[1] if parent else '/'}{pk}/"
+            depth = parent[2] + 1 if parent else 0
+            joined = self.joined_at(index, total)
+            ordered_at = None
+            if self.rng.random() < options['order_rate']:
+                ordered_at = joined + timedelta(minutes=self.rng.randint(1, 24 * 60))
+            user = User(pk=pk, mobile_number=f'+91{national}', password='!', full_name=f'User {index}',
+                        date_joined=joined, referral_id=parent[0] if parent else None, referral_path=path,
+                        referral_depth=depth, is_verified=True, is_updated=True, is_free=ordered_at is None,
+                        order_complete=ordered_at is not None, is_admin=index == 0, is_staff=index == 0)
+            batch.append((user, ordered_at))
+            users.append((pk, parent[0] if parent else None, ordered_at))
+            if depth < options['depth']:
+                queue.append((pk, path, depth))
+            if len(batch) >= self.batch_size:
+                flush()
+
+        def flush():
+            nonlocal address_id, order_id, item_id
+            addresses, orders, items = [], [], []
+            order_count = sum(ordered_at is not None for _, ordered_at in batch)
+            invoice_numbers = iter(allocate_invoice_numbers(order_count) if order_count else [])
+            for user, ordered_at in batch:
+                addresses.append(Address(id=address_id, user_id=user.pk, address_line1='1 Main Road',
+                                         address_line2='', landmark='', city=self.rng.choice(CITIES),
+                                         pincode='600001'))
+                if ordered_at is not None:
+                    orders.append(Order(order_id=order_id, user_id=user.pk, date_of_transaction=ordered_at,
+                                        total_amount=ORDER_PRICE, total_tax=ORDER_TAX,
+                                        shipping_address_id=address_id, invoice_number=next(invoice_numbers),
+                                        payment_status='completed', payment_method='upi'))
+                    items.append(OrderItem(item_line_no=item_id, order_id=order_id, description='T-shirt',
+                                           price=ORDER_PRICE, tax=ORDER_TAX, quantity=1, size='M'))
+                    order_id += 1
+                    item_id += 1
+                address_id += 1
+            with transaction.atomic():
+                User.objects.bulk_create([user for user, _ in batch])
+                self.bulk_create(Address, addresses)
+                self.bulk_create(Order, orders)
+                self.bulk_create(OrderItem, items)
+            self.count(User, len(batch))
+            batch.clear()
+            if self.verbosity > 1:
+                self.stdout.write(f'{len(users)} users')
+
+        head = 0
+        while len(users) < total:
+            if head == len(queue):
+                add_user(None)  # every branch is at the depth limit, start another tree
+                continue
+            parent = queue[head]
+            head += 1
+            for _ in range(self.rng.randint(1, options['fan_out'])):
+                if len(users) == total:
+                    break
+                add_user(parent)
+            if head > 100000:
+                # drop the processed head of the queue, it holds a path string per user
+                del queue[:head]
+                head = 0
+        if batch:
+            flush()
+        return users
+
+    def generate_rewards(self, users):
+        # Replays reward_matching (api/serializers.py) for the completed orders in date order without hitting the
+        # database per order: spot rows for the referrer, a PRP row under the referrer's referrer and a PRPMatching
+        # and SRP row when an open slot of the primary user is filled. Rows get explicit primary keys so matchings
+        # can point at PRP rows of earlier batches.
+        referral_of = {pk: referral for pk, referral, _ in users}
+        joined_order = {pk: index for index, (pk, _, _) in enumerate(users)}
+        prp_id, matching_id, srp_id, spot_id = (next_id(PrimaryRewardPoint), next_id(PRPMatching),
+                                                next_id(SecondaryRewardPoint), next_id(SpotRewardPoint))
+        prp_rows = []  # [id, date, PRP_user, referred_by, new_user, matching_count]
+        open_slots = {}  # primary user -> PRP rows with matching_count < 2, oldest first
+        has_srp = set()
+        matchings, srps, spots = [], [], []
+
+        for pk, referral, ordered_at in users:
+            if referral is None:
+                continue
+            spots.append((spot_id, self.joined_at(joined_order[pk], len(users)), referral, pk))
+            spot_id += 1
+            if ordered_at is None:
+                continue
+
+            primary = referral_of[referral] or referral
+            slots = open_slots.setdefault(primary, [])
+            slot = next((row for row in slots if row[3] == referral), None) or (slots[0] if slots else None)
+            row = [prp_id, ordered_at, primary, referral, pk, 0]
+            if slot is not None:
+                slot[5] += 1
+                row[5] = 1
+                if slot[5] == 2:
+                    slots.remove(slot)
+                matchings.append((matching_id, prp_id, pk, slot[4]))
+                matching_id += 1
+                if slot[3] != referral:
+                    selected = min(referral, slot[3], key=joined_order.get)  # the referrer who joined first
+                    eligible = referral if selected in has_srp else selected
+                    has_srp.add(eligible)
+                    srps.append((srp_id, ordered_at, prp_id, referral, slot[3], eligible,
+                                 'first_join' if eligible == selected else 'first_reward'))
+                    srp_id += 1
+            slots.append(row)
+            prp_rows.append(row)
+            prp_id += 1
+
+        # matching counts are final only now, PRP rows are written before the rows pointing at them. Rows are
+        # kept as tuples and turned into model instances one batch at a time.
+        self.bulk_create(PrimaryRewardPoint, (
+            PrimaryRewardPoint(id=id_, date=date, PRP_user_id=primary, referred_by_id=referred_by, new_user_id=new_user,
+                               matching_count=matching_count)
+            for id_, date, primary, referred_by, new_user, matching_count in prp_rows))
+        self.bulk_create(PRPMatching, (
+            PRPMatching(id=id_, PRP_id_id=prp, matching_user1_id=user1, matching_user2_id=user2)
+            for id_, prp, user1, user2 in matchings))
+        self.bulk_create(SecondaryRewardPoint, (
+            SecondaryRewardPoint(id=id_, date=date, PRP_id_id=prp, referred_su1_id=su1, referred_su2_id=su2,
+                                 eligible_su_id=eligible, reward_category=category)
+            for id_, date, prp, su1, su2, eligible, category in srps))
+        self.bulk_create(SpotRewardPoint, (
+            SpotRewardPoint(id=id_, date=date, eligible_user_id=eligible, referral=str(referral))
+            for id_, date, eligible, referral in spots))
+
+    def bulk_create(self, model, rows):
+        rows = iter(rows)
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            self.count(model, len(batch))
+
+    def count(self, model, created):
+        self.created[model] = self.created.get(model, 0) + created
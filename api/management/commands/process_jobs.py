@@ -0,0 +1,45 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.jobs import run_pending_jobs, work
+
+
+def worker(queues, sleep):
+    connections.close_all()
+    work(queues, sleep)
+
+
+class Command(BaseCommand):
+    help = 'Process queued background jobs (reward matching, ...) with a pool of local worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues', help='Only process this queue, repeatable.')
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when all queues are empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the queues and exit.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = run_pending_jobs(options['queues'])
+            self.stdout.write(f'{processed} jobs processed')
+            return
+
+        # forked workers must not share the parent's database connection
+        connections.close_all()
+        for connection in connections.all():
+            # the pooled backend keeps closed connections open for reuse
+            if hasattr(connection, 'close_pool'):
+                connection.close_pool()
+        processes = [multiprocessing.Process(target=worker, args=(options['queues'], options['sleep']), daemon=True)
+                     for _ in range(options['workers'])]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'{len(processes)} workers started')
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
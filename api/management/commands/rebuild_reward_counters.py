@@ -0,0 +1,69 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from api.models import User, RewardCounter, SpotRewardPoint, SecondaryRewardPoint, PRPMatching
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-user reward counters from the source tables, or only verify them with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Report mismatches without writing anything.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expected = self.compute_counters()
+        existing = {counter.pk: counter for counter in RewardCounter.objects.all().iterator()}
+
+        to_create, to_update, mismatches = [], [], 0
+        for user_id, counts in expected.items():
+            counter = existing.get(user_id)
+            if counter is None:
+                to_create.append(RewardCounter(user_id=user_id, **counts))
+                mismatches += 1
+            elif any(getattr(counter, field) != value for field, value in counts.items()):
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{user_id}: ' + ', '.join(
+                        f'{field} {getattr(counter, field)} != {value}' for field, value in counts.items()
+                        if getattr(counter, field) != value))
+                for field, value in counts.items():
+                    setattr(counter, field, value)
+                to_update.append(counter)
+                mismatches += 1
+
+        if options['verify']:
+            if to_update:
+                raise CommandError(f'{len(to_update)} reward counters are out of sync '
+                                   f'({len(to_create)} users have no counter row yet).')
+            self.stdout.write(self.style.SUCCESS(
+                f'Reward counters verified, {len(to_create)} users have no counter row yet.'))
+            return
+
+        with transaction.atomic():
+            RewardCounter.objects.bulk_create(to_create, batch_size=options['batch_size'])
+            RewardCounter.objects.bulk_update(to_update, RewardCounter.COUNTER_FIELDS,
+                                              batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt reward counters for {len(expected)} users, {mismatches} rows written.'))
+
+    def compute_counters(self):
+        parents = dict(User.objects.values_list('pk', 'referral_id').iterator())
+
+        referral_count = Counter(parent for parent in parents.values() if parent in parents)
+        second_level_count = Counter(parents.get(parent) for parent in parents.values() if parent in parents)
+        spot_count = dict(SpotRewardPoint.objects.values_list('eligible_user').annotate(Count('pk')))
+        srp_count = dict(SecondaryRewardPoint.objects.values_list('eligible_su').annotate(Count('pk')))
+        prp_match_count = dict(PRPMatching.objects.values_list('PRP_id__PRP_user').annotate(Count('pk')))
+
+        return {
+            user_id: {
+                'spot_count': spot_count.get(user_id, 0),
+                'srp_count': srp_count.get(user_id, 0),
+                'prp_match_count': prp_match_count.get(user_id, 0),
+                'referral_count': referral_count[user_id],
+                'second_level_referral_count': second_level_count[user_id],
+            } for user_id in parents
+        }
@@ -0,0 +1,43 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.sms import dispatch_pending_sms
+
+
+def sender(batch_size, sleep):
+    try:
+        while True:
+            if not dispatch_pending_sms(batch_size):
+                time.sleep(sleep)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Send queued SMS from the outbox. Senders are threads sharing one keep-alive connection pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=10, help='Messages claimed by a sender at a time.')
+        parser.add_argument('--sleep', type=float, default=0.5, help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox and exit.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = dispatch_pending_sms(options['batch_size'])
+            self.stdout.write(f'{processed} messages processed')
+            return
+
+        threads = [threading.Thread(target=sender, args=(options['batch_size'], options['sleep']), daemon=True)
+                   for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'{len(threads)} senders started')
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,47 @@
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the SMS gateway, set SMS_GATEWAY_URL=http://127.0.0.1:<port>/bulksms/bulksms ' \
+           'to load test the OTP endpoints without the provider.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds every response is delayed.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 503.')
+
+    def handle(self, *args, **options):
+        latency, error_rate = options['latency'], options['error_rate']
+        stats = {'requests': 0}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real gateway
+
+            def do_GET(self):
+                stats['requests'] += 1
+                time.sleep(latency)
+                if random.random() < error_rate:
+                    body, status = b'{"error": "unavailable"}', 503
+                else:
+                    body, status = json.dumps({'messageId': uuid.uuid4().hex}).encode(), 200
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), Handler)
+        self.stdout.write(f'SMS stub gateway on http://127.0.0.1:{options["port"]}/bulksms/bulksms')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(f'{stats["requests"]} requests served')
@@ -0,0 +1,120 @@
+import statistics
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, IntegrityError
+
+from api.models import Order, User
+from api.utils import allocate_invoice_numbers
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent checkouts or signups against the configured database and report invoice number / ' \
+           'user id collisions and latency as the tables grow.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--signups', action='store_true', help='Create users in parallel instead of orders.')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--iterations', type=int, default=250, help='Orders or users created per worker.')
+        parser.add_argument('--block-size', type=int, default=0,
+                            help='Pre-allocate invoice numbers in blocks of this size instead of one per order.')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows.')
+
+    def handle(self, *args, **options):
+        if options['signups']:
+            self.stress_signups(options)
+        else:
+            self.stress_checkouts(options)
+
+    def run_workers(self, options, work):
+        # work(worker, iteration) returns the allocated value, an IntegrityError counts as a collision
+        latencies = []
+        values = []
+        errors = Counter()
+        lock = threading.Lock()
+
+        def worker_loop(worker):
+            state = {}
+            try:
+                for iteration in range(options['iterations']):
+                    started = time.perf_counter()
+                    try:
+                        value = work(worker, iteration, state)
+                    except IntegrityError:
+                        with lock:
+                            errors['collision'] += 1
+                        continue
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        values.append(value)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker_loop, args=(worker,)) for worker in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        self.stdout.write(f'{len(values)} rows in {wall:.2f}s by {options["workers"]} workers '
+                          f'({len(values) / wall:.0f} rows/sec)')
+        # latency per tenth of the run shows whether allocation slows down as the table grows
+        tenth = max(len(latencies) // 10, 1)
+        for i in range(0, len(latencies), tenth):
+            window = sorted(latencies[i:i + tenth])
+            self.stdout.write(f'  rows {i:>6}-{i + len(window):<6} median {statistics.median(window) * 1000:7.2f}ms '
+                              f'p99 {window[min(len(window) - 1, int(len(window) * 0.99))] * 1000:7.2f}ms')
+
+        duplicates = sum(count - 1 for count in Counter(values).values() if count > 1)
+        return duplicates, errors['collision']
+
+    def stress_checkouts(self, options):
+        user, created = User.objects.get_or_create(mobile_number='+910000000000', defaults={'full_name': 'stress test'})
+
+        def checkout(worker, iteration, state):
+            if options['block_size']:
+                if not state.get('pending'):
+                    state['pending'] = allocate_invoice_numbers(options['block_size'])
+                order = Order.objects.create(user=user, total_amount=Decimal('0'),
+                                             invoice_number=state['pending'].pop(0))
+            else:
+                order = Order.objects.create(user=user, total_amount=Decimal('0'))
+            return order.invoice_number
+
+        self.stdout.write(f'Orders table starts at {Order.objects.count()} rows')
+        duplicates, collisions = self.run_workers(options, checkout)
+
+        if not options['keep']:
+            Order.objects.filter(user=user).delete()
+            if created:
+                user.delete()
+
+        if duplicates or collisions:
+            raise CommandError(f'{duplicates} duplicate invoice numbers, {collisions} unique violations')
+        self.stdout.write(self.style.SUCCESS('No invoice number collisions.'))
+
+    def stress_signups(self, options):
+        mobile_numbers = []
+
+        def signup(worker, iteration, state):
+            mobile_number = f'+917{worker:03d}{iteration:06d}'
+            user, _ = User.objects.get_or_create(mobile_number=mobile_number)
+            mobile_numbers.append(mobile_number)
+            # the pk is "<national number><sequence>", see generate_user_id
+            return str(user.pk)[len(str(user.mobile_number.national_number)):]
+
+        self.stdout.write(f'Users table starts at {User.objects.count()} rows')
+        duplicates, collisions = self.run_workers(options, signup)
+
+        if not options['keep']:
+            User.objects.filter(mobile_number__in=mobile_numbers).delete()
+
+        if duplicates or collisions:
+            raise CommandError(f'{duplicates} duplicate user id sequences, {collisions} unique violations')
+        self.stdout.write(self.style.SUCCESS('No user id collisions.'))
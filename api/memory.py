@@ -0,0 +1,63 @@
+import logging
+import random
+import threading
+import tracemalloc
+
+from django.conf import settings
+
+from api.metrics import observe
+
+# Opt-in tracemalloc tracking of the large report views, a MEMORY_TRACKING_RATE share of the requests to
+# MEMORY_TRACKING_VIEWS is tracked. tracemalloc traces the whole process, so one request per process is tracked at
+# a time and allocations of other threads count into its peak, the numbers are exact with one thread per worker.
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+IGNORED_FRAMES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def memory_sampled(view):
+    rate = getattr(settings, 'MEMORY_TRACKING_RATE', 0)
+    return rate > 0 and view in getattr(settings, 'MEMORY_TRACKING_VIEWS', ()) and random.random() < rate
+
+
+class MemoryTracker:
+    def __init__(self):
+        self.started_tracing = False
+        self.baseline = None
+        self.baseline_size = 0
+
+    def start(self):
+        if not _lock.acquire(blocking=False):
+            return False  # another request of this process is tracked
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(getattr(settings, 'MEMORY_TRACKING_FRAMES', 1))
+        tracemalloc.reset_peak()
+        self.baseline_size = tracemalloc.get_traced_memory()[0]
+        self.baseline = tracemalloc.take_snapshot()
+        return True
+
+    def stop(self, view, method):
+        try:
+            peak = tracemalloc.get_traced_memory()[1] - self.baseline_size
+            snapshot = tracemalloc.take_snapshot()
+            if self.started_tracing:
+                tracemalloc.stop()
+        finally:
+            _lock.release()
+
+        # the sites still holding memory at the end of the view, the response data among them
+        top = snapshot.filter_traces(IGNORED_FRAMES).compare_to(self.baseline.filter_traces(IGNORED_FRAMES),
+                                                                 'lineno')
+        top = [stat for stat in top if stat.size_diff > 0][:getattr(settings, 'MEMORY_TRACKING_TOP', 10)]
+        observe('http_request_peak_memory_bytes', (('view', view), ('method', method)), peak)
+        logger.info('%s %s peak %.1f MiB, top allocation sites:\n%s', method, view, peak / 2 ** 20, '\n'.join(
+            f'  {stat.traceback[0].filename}:{stat.traceback[0].lineno} +{stat.size_diff / 1024:.1f} KiB '
+            f'({stat.count_diff:+} blocks)' for stat in top))
+        return peak, top
@@ -0,0 +1,167 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from api.profiling import authenticated_admin
+from core.cache import cache_lock
+
+# Per-view request histograms in the Prometheus text format. Every process keeps its own histograms and a
+# background thread writes a snapshot of them to the METRICS_CACHE cache every METRICS_FLUSH_INTERVAL seconds,
+# /metrics adds up the snapshots of all processes sharing that cache (the file based cache is shared per host).
+# The registry lists the processes that flushed, a process that has not flushed for SNAPSHOT_TTL_INTERVALS
+# intervals is gone and drops out of the totals.
+REGISTRY_KEY = 'metrics:processes'
+SNAPSHOT_TTL_INTERVALS = 4
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Request duration by view.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'http_request_db_queries': (
+        'SQL statements per request by view.',
+        (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)),
+    'http_request_db_duration_seconds': (
+        'Time spent in SQL per request by view.',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)),
+    'http_request_peak_memory_bytes': (
+        'Peak traced memory of requests tracked by api.memory, by view.',
+        tuple(2 ** 20 * size for size in (1, 4, 16, 64, 128, 256, 512, 1024, 2048))),
+}
+
+_lock = threading.Lock()
+_state = {'histograms': {}, 'flusher_pid': None}
+
+
+def process_key():
+    return f'metrics:{socket.gethostname()}:{os.getpid()}'
+
+
+def metrics_cache():
+    return caches[getattr(settings, 'METRICS_CACHE', 'default')]
+
+
+def observe(name, labels, value):
+    # labels is a tuple of (label, value) pairs
+    buckets = HISTOGRAMS[name][1]
+    with _lock:
+        series = _state['histograms'].setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:  # cumulative, as Prometheus buckets are
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def observe_request(view, method, duration, query_count, db_duration):
+    labels = (('view', view), ('method', method))
+    observe('http_request_duration_seconds', labels, duration)
+    observe('http_request_db_queries', labels, query_count)
+    observe('http_request_db_duration_seconds', labels, db_duration)
+    start_flusher()
+
+
+def start_flusher():
+    # one thread per process, a forked worker starts its own
+    pid = os.getpid()
+    if _state['flusher_pid'] == pid:
+        return
+    with _lock:
+        if _state['flusher_pid'] == pid:
+            return
+        _state['flusher_pid'] = pid
+    threading.Thread(target=flush_periodically, name='metrics-flush', daemon=True).start()
+
+
+def flush_periodically():
+    # also while the process is idle, so the snapshot of a live process never expires
+    while True:
+        time.sleep(getattr(settings, 'METRICS_FLUSH_INTERVAL', 15))
+        try:
+            flush()
+        except Exception:
+            # the next flush writes the whole snapshot again
+            logger.exception('Could not flush the request metrics')
+
+
+def snapshot():
+    with _lock:
+        return {name: {labels: {'buckets': list(histogram['buckets']), 'sum': histogram['sum'],
+                                'count': histogram['count']}
+                       for labels, histogram in series.items()}
+                for name, series in _state['histograms'].items()}
+
+
+def flush():
+    cache = metrics_cache()
+    key = process_key()
+    ttl = getattr(settings, 'METRICS_FLUSH_INTERVAL', 15) * SNAPSHOT_TTL_INTERVALS
+    cache.set(key, snapshot(), ttl)
+    now = time.time()
+    # every process reads, changes and writes back the registry
+    with cache_lock(cache, REGISTRY_KEY):
+        # process key -> time its snapshot expires
+        processes = {process: expires_at for process, expires_at in (cache.get(REGISTRY_KEY) or {}).items()
+                     if expires_at > now}
+        processes[key] = now + ttl
+        cache.set(REGISTRY_KEY, processes, None)
+
+
+def collect():
+    # histograms of every live process, the snapshot of a process that went away expires and drops out
+    flush()
+    cache = metrics_cache()
+    totals = {}
+    for snapshot_ in cache.get_many(list(cache.get(REGISTRY_KEY) or {})).values():
+        for name, series in snapshot_.items():
+            for labels, histogram in series.items():
+                total = totals.setdefault(name, {}).setdefault(
+                    labels, {'buckets': [0] * len(histogram['buckets']), 'sum': 0.0, 'count': 0})
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+                total['sum'] += histogram['sum']
+                total['count'] += histogram['count']
+    return totals
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(totals):
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in sorted(totals.get(name, {}).items()):
+            label_text = ','.join(f'{label}="{escape(value)}"' for label, value in labels)
+            for bound, count in zip(buckets, histogram['buckets']):
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{name}_sum{{{label_text}}} {histogram["sum"]}')
+            lines.append(f'{name}_count{{{label_text}}} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def authorized(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    # an admin's JWT works as well, it is the only way in while no token is set
+    return authenticated_admin(request)
+
+
+def metrics_view(request):
+    if not authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,203 @@
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from api.memory import MemoryTracker, memory_sampled
+from api.metrics import observe_request
+from api.profiling import requested_by_admin, sampled, start_profile, save_profile, PROFILE_HEADER
+from api.slow_queries import record_slow_query, explaining, threshold as slow_query_threshold
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    # connection.execute_wrapper hook counting the statements of one request and timing them, statements over
+    # SLOW_QUERY_THRESHOLD_MS go to the slow query buffer (api.slow_queries)
+    def __init__(self, request=None):
+        self.request = request
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = None
+        self.slow_threshold = slow_query_threshold()
+
+    def __call__(self, execute, sql, params, many, context):
+        if explaining():
+            return execute(sql, params, many, context)  # the recorder's own EXPLAIN
+        started = time.perf_counter()
+        try:
+            result = execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if elapsed > self.slowest_duration:
+                self.slowest_duration, self.slowest_sql = elapsed, sql
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            record_slow_query(context['connection'], sql, params, many, elapsed, view_name(self.request))
+        return result
+
+
+@contextmanager
+def recording(recorder):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    view = getattr(match.func, 'view_class', match.func)
+    return view.__qualname__
+
+
+class SQLMetricsMiddleware:
+    """Query count, SQL time and slowest statement per request, as Server-Timing header and /metrics histograms."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(request)
+        request.sql_metrics = recorder
+        started = time.perf_counter()
+        with recording(recorder):
+            response = self.get_response(request)
+
+        if getattr(settings, 'SERVER_TIMING', True):
+            response['Server-Timing'] = self.server_timing(recorder, time.perf_counter() - started)
+        if response.streaming:
+            # streamed reports query while the body is sent, they are recorded once it is done
+            response.streaming_content = self.record_stream(response.streaming_content, request, recorder, started)
+        else:
+            self.observe(request, recorder, started)
+        return response
+
+    def record_stream(self, content, request, recorder, started):
+        try:
+            with recording(recorder):
+                yield from content
+        finally:
+            self.observe(request, recorder, started)
+
+    def observe(self, request, recorder, started):
+        duration = time.perf_counter() - started
+        view = view_name(request)
+        observe_request(view, request.method, duration, recorder.count, recorder.duration)
+        logger.debug('%s %s: %.1f ms, %d queries in %.1f ms, slowest %.1f ms: %s', request.method, view,
+                     duration * 1000, recorder.count, recorder.duration * 1000, recorder.slowest_duration * 1000,
+                     recorder.slowest_sql)
+
+    def server_timing(self, recorder, duration):
+        return f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", ' \
+               f'db-slowest;dur={recorder.slowest_duration * 1000:.1f}, ' \
+               f'total;dur={duration * 1000:.1f}'
+
+
+def call_view(view_func, request, view_args, view_kwargs):
+    response = view_func(request, *view_args, **view_kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        # DRF responses render after process_view returns, the rendering belongs to the measurement
+        response = response.render()
+    return response
+
+
+class MeasuredStream:
+    # Measures producing each chunk of a streamed body, not the server sending it. finish runs once the body is
+    # done or the response is closed, also when the body was never iterated.
+    def __init__(self, content, resume, pause, finish):
+        self.content = content
+        self.chunks = iter(content)
+        self.resume, self.pause, self.finish = resume, pause, finish
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.resume()
+        try:
+            chunk = next(self.chunks, self)
+        finally:
+            self.pause()
+        if chunk is self:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        if self.finished:
+            return
+        self.finished = True
+        if hasattr(self.content, 'close'):
+            self.content.close()
+        self.finish()
+
+
+class ProfilingMiddleware:
+    """Runs admin requested ("X-Profile: 1") or sampled requests under cProfile, see api.profiling."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = view_name(request)
+        requested = requested_by_admin(request)
+        if not requested and not sampled(view):
+            return None
+        profiler = start_profile()
+        if profiler is None:
+            return None
+        try:
+            response = call_view(view_func, request, view_args, view_kwargs)
+        except Exception:
+            profiler.disable()
+            save_profile(profiler, view)
+            raise
+        profiler.disable()
+        if response.streaming:
+            response.streaming_content = MeasuredStream(response.streaming_content, profiler.enable,
+                                                        profiler.disable, lambda: save_profile(profiler, view))
+        else:
+            name = save_profile(profiler, view)
+            if requested:
+                response[PROFILE_HEADER] = name
+        return response
+
+
+class MemoryTrackingMiddleware:
+    """Peak memory and top allocation sites of sampled MEMORY_TRACKING_VIEWS requests, see api.memory."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = view_name(request)
+        if not memory_sampled(view):
+            return None
+        tracker = MemoryTracker()
+        if not tracker.start():
+            return None
+        try:
+            response = call_view(view_func, request, view_args, view_kwargs)
+        except Exception:
+            tracker.stop(view, request.method)
+            raise
+        if response.streaming:
+            response.streaming_content = MeasuredStream(response.streaming_content, lambda: None, lambda: None,
+                                                        lambda: tracker.stop(view, request.method))
+        else:
+            tracker.stop(view, request.method)
+        return response
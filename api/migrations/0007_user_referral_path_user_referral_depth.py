@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def backfill_referral_paths(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    parents = {}
+    children = defaultdict(list)
+    for pk, referral_id in User.objects.values_list('pk', 'referral_id').iterator():
+        parents[pk] = referral_id
+
+    roots = []
+    for pk, referral_id in parents.items():
+        parent = int(referral_id) if referral_id and referral_id.isdigit() else None
+        if parent in parents and parent != pk:
+            children[parent].append(pk)
+        else:
+            roots.append(pk)
+
+    paths = {}
+    queue = [(pk, f'/{pk}/') for pk in roots]
+    while queue:
+        pk, path = queue.pop()
+        paths[pk] = path
+        queue.extend((child, f'{path}{child}/') for child in children[pk] if child not in paths)
+
+    # anything unreachable from a root sits in a referral cycle, keep those as their own roots
+    for pk in parents:
+        paths.setdefault(pk, f'/{pk}/')
+
+    batch = []
+    for pk, path in paths.items():
+        batch.append(User(pk=pk, referral_path=path, referral_depth=path.count('/') - 2))
+        if len(batch) == 1000:
+            User.objects.bulk_update(batch, ['referral_path', 'referral_depth'])
+            batch = []
+    if batch:
+        User.objects.bulk_update(batch, ['referral_path', 'referral_depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_alter_order_payment_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='referral_depth',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='referral_path',
+            field=models.TextField(blank=True, db_index=True, default=''),
+        ),
+        migrations.RunPython(backfill_referral_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.1 on 2026-10-18 02:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_user_referral_path_user_referral_depth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewardCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reward_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('spot_count', models.IntegerField(default=0)),
+                ('srp_count', models.IntegerField(default=0)),
+                ('prp_match_count', models.IntegerField(default=0)),
+                ('referral_count', models.IntegerField(default=0)),
+                ('second_level_referral_count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
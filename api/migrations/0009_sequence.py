@@ -0,0 +1,31 @@
+# Generated by Django 4.2.1 on 2026-10-18 02:19
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def seed_invoice_sequence(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    Sequence = apps.get_model('api', 'Sequence')
+    last_invoice = Order.objects.filter(invoice_number__regex=r'^M[0-9]+$') \
+        .order_by(Length('invoice_number').desc(), '-invoice_number').values_list('invoice_number', flat=True).first()
+    Sequence.objects.create(name='invoice_number', last_value=int(last_invoice[1:]) if last_invoice else 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_rewardcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_invoice_sequence, migrations.RunPython.noop),
+    ]
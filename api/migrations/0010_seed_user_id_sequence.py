@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def seed_user_id_sequence(apps, schema_editor):
+    # user ids are "<national number>_<sequence>" stored as a bigint, so the sequence is what follows the number
+    User = apps.get_model('api', 'User')
+    Sequence = apps.get_model('api', 'Sequence')
+    last_value = User.objects.count()
+    for pk, mobile_number in User.objects.values_list('pk', 'mobile_number').iterator():
+        national_number = str(getattr(mobile_number, 'national_number', '') or '')
+        suffix = str(pk)[len(national_number):]
+        if national_number and str(pk).startswith(national_number) and suffix.isdigit():
+            last_value = max(last_value, int(suffix))
+    Sequence.objects.update_or_create(name='user_id', defaults={'last_value': last_value})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_user_id_sequence, migrations.RunPython.noop),
+    ]
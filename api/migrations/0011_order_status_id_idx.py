@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-18 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_seed_user_id_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', '-order_id'], name='order_status_id_idx'),
+        ),
+    ]
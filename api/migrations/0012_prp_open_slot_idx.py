@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-18 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_order_status_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='primaryrewardpoint',
+            index=models.Index(condition=models.Q(('matching_count__lt', 2)), fields=['PRP_user', 'referred_by', 'id'], name='prp_open_slot_idx'),
+        ),
+    ]
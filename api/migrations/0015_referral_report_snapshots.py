@@ -0,0 +1,43 @@
+# Generated by Django 4.2.1 on 2026-10-18 02:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_smsoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralReportState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='referral_report_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('week_start', models.DateTimeField()),
+                ('is_dirty', models.BooleanField(default=False)),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='referralreport',
+            name='position',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='referralreport',
+            name='referrer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='referralreport',
+            name='week_start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='referralreport',
+            index=models.Index(fields=['referrer', 'week_start', 'position'], name='referral_report_week_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.1 on 2026-10-18 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_referral_report_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payout',
+            index=models.Index(fields=['start_date', 'end_date'], name='payout_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='primaryrewardpoint',
+            index=models.Index(fields=['date', 'PRP_user'], name='prp_date_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='primaryrewardpoint',
+            index=models.Index(fields=['referred_by', 'date'], name='prp_referred_by_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='secondaryrewardpoint',
+            index=models.Index(fields=['eligible_su', 'date'], name='srp_eligible_su_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['referral_id'], name='user_referral_id_idx'),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# The string columns holding User pks are kept as *_legacy, the foreign keys added under the original names
+# are filled by 0018_backfill_user_references.
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_report_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_referral_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='primaryrewardpoint',
+            name='prp_open_slot_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='primaryrewardpoint',
+            name='prp_referred_by_date_idx',
+        ),
+        migrations.RenameField(
+            model_name='user',
+            old_name='referral_id',
+            new_name='referral_id_legacy',
+        ),
+        migrations.RenameField(
+            model_name='primaryrewardpoint',
+            old_name='referred_by',
+            new_name='referred_by_legacy',
+        ),
+        migrations.RenameField(
+            model_name='primaryrewardpoint',
+            old_name='new_user',
+            new_name='new_user_legacy',
+        ),
+        migrations.RenameField(
+            model_name='prpmatching',
+            old_name='matching_user1',
+            new_name='matching_user1_legacy',
+        ),
+        migrations.RenameField(
+            model_name='prpmatching',
+            old_name='matching_user2',
+            new_name='matching_user2_legacy',
+        ),
+        migrations.RenameField(
+            model_name='secondaryrewardpoint',
+            old_name='referred_su1',
+            new_name='referred_su1_legacy',
+        ),
+        migrations.RenameField(
+            model_name='secondaryrewardpoint',
+            old_name='referred_su2',
+            new_name='referred_su2_legacy',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='referral',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='primaryrewardpoint',
+            name='referred_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='primaryrewardpoint',
+            name='new_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='prpmatching',
+            name='matching_user1',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='prpmatching',
+            name='matching_user2',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='secondaryrewardpoint',
+            name='referred_su1',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='secondaryrewardpoint',
+            name='referred_su2',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='primaryrewardpoint',
+            index=models.Index(condition=models.Q(('matching_count__lt', 2)), fields=['PRP_user', 'referred_by', 'id'], name='prp_open_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='primaryrewardpoint',
+            index=models.Index(fields=['referred_by', 'date'], name='prp_referred_by_date_idx'),
+        ),
+    ]
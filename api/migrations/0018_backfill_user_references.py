@@ -0,0 +1,24 @@
+# Batched and resumable. Large tables can be filled by `manage.py backfill_user_references` instead, which can be
+# stopped and started again: `manage.py migrate api 0017`, then `manage.py backfill_user_references`, then
+# `manage.py migrate`, this migration then only picks up the remaining rows. The foreign keys only exist from 0017
+# on and 0017 renames the columns the code before it reads, so all three steps are part of the deploy.
+
+from django.db import migrations
+
+from api.backfills import backfill_user_references
+
+
+def backfill(apps, schema_editor):
+    backfill_user_references(apps)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('api', '0017_user_reference_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -2,10 +2,14 @@ from decimal import Decimal
 
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import BaseUserManager
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
-from .utils import generate_otp, generate_user_id
+from .configuration import bump_configuration_version, payout_rates
+from .utils import generate_otp, generate_user_id, allocate_invoice_numbers
 from .validator import validate_possible_number
 
 GENDER = (('male', 'male'),
@@ -35,6 +39,17 @@ REWARD_CLAIM = (
 PROOF = (('ID1', 'ID1'),
          ('ID2', 'ID2'))
 
+JOB_STATUS = (('pending', 'pending'),
+              ('running', 'running'),
+              ('done', 'done'),
+              ('failed', 'failed'))
+
+SMS_STATUS = (('pending', 'pending'),
+              ('sending', 'sending'),
+              ('sent', 'sent'),
+              ('failed', 'failed'),
+              ('expired', 'expired'))
+
 PAYMENT_STATUS_CHOICES = [
         ('pending', 'pending'),
         ('completed', 'completed')
@@ -76,8 +91,13 @@ class User(AbstractUser):
     is_admin = models.BooleanField(default=False)
     is_free = models.BooleanField(default=True)
     order_complete = models.BooleanField(default=False)
-    referral_id = models.CharField(blank=True, null=True,
-                                   max_length=250)  # (editable=False) will make this as one-time-writable field
+    referral = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True, null=True,
+                                 related_name='+')  # (editable=False) will make this as one-time-writable field
+    # the referrer as it was stored before `referral`, see api.backfills
+    referral_id_legacy = models.CharField(blank=True, null=True, max_length=250)
+    # materialized ancestor path ("/root_pk/.../own_pk/") and depth, kept in sync with referral_id
+    referral_path = models.TextField(blank=True, default="", db_index=True)
+    referral_depth = models.IntegerField(default=0)
     username = None
 
     USERNAME_FIELD = 'mobile_number'
@@ -92,8 +112,36 @@ class User(AbstractUser):
     def save(self, *args, **kwargs):
         if not self.pk:
             self.pk = generate_user_id(self.date_joined, self.mobile_number)
+        if not self.referral_path:
+            self.referral_path = self.build_referral_path()
+            self.referral_depth = self.referral_path.count('/') - 2
         super().save(*args, **kwargs)
 
+    def build_referral_path(self):
+        parent_path = None
+        if self.referral_id:
+            parent_path = User.objects.filter(pk=self.referral_id).values_list('referral_path', flat=True).first()
+        return f"{parent_path or '/'}{int(self.pk)}/"
+
+    def sync_referral_path(self):
+        # Recompute own path after referral_id changed and move the whole downline along with it.
+        # The instance itself is not saved here, the caller persists it.
+        old_path = self.referral_path
+        new_path = self.build_referral_path()
+        if old_path == new_path:
+            return
+        depth_delta = (new_path.count('/') - 2) - self.referral_depth
+        self.referral_path = new_path
+        self.referral_depth = new_path.count('/') - 2
+        if old_path:
+            User.objects.filter(referral_path__startswith=old_path).exclude(pk=self.pk).update(
+                referral_path=Concat(Value(new_path), Substr('referral_path', len(old_path) + 1)),
+                referral_depth=F('referral_depth') + depth_delta)
+
+    def downline(self):
+        return User.objects.filter(referral_path__startswith=self.referral_path,
+                                   referral_depth__gt=self.referral_depth)
+
     @property
     def simple_mobile_number(self):
         return self.mobile_number.national_number
@@ -114,11 +162,26 @@ class Configuration(models.Model):
             self.decimal_value = Decimal(self.value) / Decimal(100)
 
         super().save(*args, **kwargs)
+        transaction.on_commit(bump_configuration_version)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        transaction.on_commit(bump_configuration_version)
+        return result
 
     def __str__(self):
         return self.config_name
 
 
+class Sequence(models.Model):
+    # named counters handed out by api.utils.allocate_sequence
+    name = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} - {self.last_value}"
+
+
 class Address(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='addresses')
     address_line1 = models.CharField(max_length=255)
@@ -145,6 +208,12 @@ class Order(models.Model):
     delivery_partner = models.CharField(max_length=255, null=True, blank=True, help_text="Delivery partner's name.")
     payment_status = models.CharField(max_length=30, choices=PAYMENT_STATUS_CHOICES, default='pending')
     payment_method = models.CharField(max_length=20, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['payment_status', '-order_id'], name='order_status_id_idx'),
+        ]
+
     @property
     def order_items(self):
         return self.order_items.all()
@@ -152,22 +221,7 @@ class Order(models.Model):
     def save(self, *args, **kwargs):
         if not self.invoice_number:
             # Generate a new invoice number if it doesn't already exist
-            last_order = Order.objects.order_by('-date_of_transaction').first()
-            if last_order:
-                last_invoice_number = last_order.invoice_number
-                if last_invoice_number:
-                    # Extract the numeric part and increment it
-                    last_number = int(last_invoice_number[1:])
-                    new_number = last_number + 1
-                    new_invoice_number = f"M{new_number:07d}"  # Format to 7 digits with 'M' prefix
-                else:
-                    # If the last invoice number is invalid, start from 'M00000001'
-                    new_invoice_number = "M0000001"
-            else:
-                # If there are no previous orders, start from 'M00000001'
-                new_invoice_number = "M0000001"
-
-            self.invoice_number = new_invoice_number
+            self.invoice_number = allocate_invoice_numbers()[0]
 
         super().save(*args, **kwargs)
 
@@ -187,31 +241,52 @@ class OrderItem(models.Model):
 class PrimaryRewardPoint(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     PRP_user = models.ForeignKey(User, on_delete=models.CASCADE)
-    referred_by = models.CharField(blank=True, null=True, max_length=100)
-    new_user = models.CharField(blank=True, null=True, max_length=100)
+    referred_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    new_user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    referred_by_legacy = models.CharField(blank=True, null=True, max_length=100)
+    new_user_legacy = models.CharField(blank=True, null=True, max_length=100)
     matching_count = models.IntegerField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # open matching slots per primary user, see api.utils.open_prp_slot
+            models.Index(fields=['PRP_user', 'referred_by', 'id'], condition=models.Q(matching_count__lt=2),
+                         name='prp_open_slot_idx'),
+            # reward points of a week, overall or per referral (payout and referral reports)
+            models.Index(fields=['date', 'PRP_user'], name='prp_date_user_idx'),
+            models.Index(fields=['referred_by', 'date'], name='prp_referred_by_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.PRP_user} - {self.date}'
 
 
 class PRPMatching(models.Model):
     PRP_id = models.ForeignKey(PrimaryRewardPoint, on_delete=models.CASCADE)
-    matching_user1 = models.CharField(blank=True, null=True, max_length=100)
-    matching_user2 = models.CharField(blank=True, null=True, max_length=100)
+    matching_user1 = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    matching_user2 = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    matching_user1_legacy = models.CharField(blank=True, null=True, max_length=100)
+    matching_user2_legacy = models.CharField(blank=True, null=True, max_length=100)
 
     def __str__(self):
-        return f'{self.matching_user1} - {self.matching_user2}'
+        return f'{self.matching_user1_id} - {self.matching_user2_id}'
 
 
 class SecondaryRewardPoint(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     PRP_id = models.ForeignKey(PrimaryRewardPoint, on_delete=models.CASCADE)
-    referred_su1 = models.CharField(blank=True, null=True, max_length=100)
-    referred_su2 = models.CharField(blank=True, null=True, max_length=100)
+    referred_su1 = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    referred_su2 = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    referred_su1_legacy = models.CharField(blank=True, null=True, max_length=100)
+    referred_su2_legacy = models.CharField(blank=True, null=True, max_length=100)
     eligible_su = models.ForeignKey(User, on_delete=models.CASCADE, related_name='eligible_su')
     reward_category = models.CharField(max_length=100, choices=REWARD_CATEGORIES)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['eligible_su', 'date'], name='srp_eligible_su_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.eligible_su}'
 
@@ -225,6 +300,21 @@ class SpotRewardPoint(models.Model):
         return f'{self.eligible_user}'
 
 
+class RewardCounter(models.Model):
+    # denormalized per-user totals behind the dashboard, see api.utils.bump_reward_counter
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='reward_counter')
+    spot_count = models.IntegerField(default=0)
+    srp_count = models.IntegerField(default=0)
+    prp_match_count = models.IntegerField(default=0)
+    referral_count = models.IntegerField(default=0)
+    second_level_referral_count = models.IntegerField(default=0)
+
+    COUNTER_FIELDS = ('spot_count', 'srp_count', 'prp_match_count', 'referral_count', 'second_level_referral_count')
+
+    def __str__(self):
+        return f"{self.user_id}'s Reward Counters"
+
+
 class Payout(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payout_user')
     start_date = models.DateTimeField()
@@ -241,6 +331,12 @@ class Payout(models.Model):
     repurchase = models.DecimalField(max_digits=10, decimal_places=2)
     final = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # payouts of a week
+            models.Index(fields=['start_date', 'end_date'], name='payout_period_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         primary_rp = self.primary_rp
         secondary_rp = self.secondary_rp
@@ -250,34 +346,53 @@ class Payout(models.Model):
         gross = sum(values) if values else None
 
         if gross is not None:
-            config = Configuration.objects.all()
-            tds = config.get(config_name="TDS").decimal_value
-            rtl = config.get(config_name="RTL").decimal_value
-            rps = config.get(config_name="RPS").decimal_value
-            self.gross = gross
-            self.tds = self.gross * tds
-            self.rental = self.gross * rtl
-            self.net = self.gross - (self.tds + self.rental)
-            self.repurchase = self.net * rps
-            self.final = self.net - self.repurchase
+            self.apply_deductions(gross, *payout_rates())
 
             super().save(*args, **kwargs)
 
+    def apply_deductions(self, gross, tds, rtl, rps):
+        self.gross = gross
+        self.tds = self.gross * tds
+        self.rental = self.gross * rtl
+        self.net = self.gross - (self.tds + self.rental)
+        self.repurchase = self.net * rps
+        self.final = self.net - self.repurchase
+
     def __str__(self):
         return f"{self.user}'s Payout Details"
 
 
 class ReferralReport(models.Model):
+    # one row of `referrer`'s weekly referral report, written by api.reports.refresh_referral_reports
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='referral_user')
+    referrer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    week_start = models.DateTimeField(null=True, blank=True)
+    position = models.IntegerField(default=0)
     total_sales = models.IntegerField()
     sales_considered = models.IntegerField()
     sales_carry_forwarded = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['referrer', 'week_start', 'position'], name='referral_report_week_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user}'s Referral Details"
 
 
+class ReferralReportState(models.Model):
+    # week of the user's ReferralReport snapshot, is_dirty is set when referrals or their sales change
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='referral_report_state')
+    week_start = models.DateTimeField()
+    is_dirty = models.BooleanField(default=False)
+    refreshed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user}'s Referral Report State"
+
+
 CRITERIA = (('RPC1', 'RPC1'),
             ('RPC2', 'RPC2'),
             ('RPC3', 'RPC3'),
@@ -310,3 +425,49 @@ class KYCImage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='kyc_user')
     image = models.ImageField(upload_to='images/')
     proof_type = models.CharField(choices=PROOF, max_length=20)
+
+
+class Job(models.Model):
+    # background work processed in strict id order per queue, see api.jobs
+    queue = models.CharField(max_length=50, default='default')
+    name = models.CharField(max_length=100)
+    key = models.CharField(max_length=200, unique=True, help_text="Idempotency key, a key is only enqueued once.")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(choices=JOB_STATUS, max_length=20, default='pending')
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'status', 'id'], name='job_queue_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} - {self.status}"
+
+
+class SMSOutbox(models.Model):
+    # outgoing SMS, sent by the dispatcher in api.sms
+    destination = models.CharField(max_length=20)
+    message = models.TextField(blank=True, default="")
+    status = models.CharField(choices=SMS_STATUS, max_length=20, default='pending')
+    attempts = models.IntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    message_id = models.CharField(max_length=100, null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='sms_outbox_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.destination} - {self.status}"
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from phonenumber_field.phonenumber import to_python
+
+# Pending OTP challenges live outside the User table, keyed by mobile number and auth hash, so generating and
+# verifying an OTP is a single keyed write/read. OTP_STORE selects the backend: CacheOTPStore (default) is shared
+# by all processes using the OTP_CACHE cache, MemoryOTPStore only works with a single process.
+
+
+def challenge_key(mobile_number, auth_hash):
+    # "+91 90000 00000" and "+919000000000" are the same number
+    return f'otp:{to_python(mobile_number)}:{auth_hash}'
+
+
+class MemoryOTPStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._challenges = {}
+
+    def set(self, mobile_number, auth_hash, challenge, timeout):
+        now = time.monotonic()
+        with self._lock:
+            # drop expired challenges on write so the dict does not grow with abandoned ones
+            self._challenges = {key: value for key, value in self._challenges.items() if value[1] > now}
+            self._challenges[challenge_key(mobile_number, auth_hash)] = (challenge, now + timeout)
+
+    def get(self, mobile_number, auth_hash):
+        challenge, expires_at = self._challenges.get(challenge_key(mobile_number, auth_hash), (None, 0))
+        return challenge if expires_at > time.monotonic() else None
+
+    def delete(self, mobile_number, auth_hash):
+        with self._lock:
+            self._challenges.pop(challenge_key(mobile_number, auth_hash), None)
+
+
+class CacheOTPStore:
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'OTP_CACHE', 'default')]
+
+    def set(self, mobile_number, auth_hash, challenge, timeout):
+        self.cache.set(challenge_key(mobile_number, auth_hash), challenge, timeout)
+
+    def get(self, mobile_number, auth_hash):
+        return self.cache.get(challenge_key(mobile_number, auth_hash))
+
+    def delete(self, mobile_number, auth_hash):
+        self.cache.delete(challenge_key(mobile_number, auth_hash))
+
+
+_store = {}
+
+
+def otp_store():
+    backend = getattr(settings, 'OTP_STORE', 'api.otp.CacheOTPStore')
+    if backend not in _store:
+        _store[backend] = import_string(backend)()
+    return _store[backend]
@@ -0,0 +1,106 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+# On-demand cProfile of single requests. An admin sends "X-Profile: 1" with their JWT to profile any view, and
+# PROFILE_SAMPLE_RATE profiles that share of the requests to PROFILE_VIEWS. Profiles are written to PROFILE_DIR as
+# <view>-<timestamp>-<pid>.prof, the newest PROFILE_KEEP are kept. Open them with `python -m pstats` or snakeviz.
+PROFILE_HEADER = 'X-Profile'
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', '/var/tmp/ecom_api_profiles'))
+
+
+def requested_by_admin(request):
+    return request.headers.get(PROFILE_HEADER, '').lower() in ('1', 'true') and authenticated_admin(request)
+
+
+def authenticated_admin(request):
+    # JWT authentication runs in the DRF view, middleware and plain Django views check the token themselves
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return False
+    return authenticated is not None and authenticated[0].is_admin
+
+
+def sampled(view):
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and view in getattr(settings, 'PROFILE_VIEWS', ()) and random.random() < rate
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is active in this thread
+        return None
+    return profiler
+
+
+def profiles_by_age(directory):
+    paths = []
+    for path in directory.glob('*.prof'):
+        try:
+            paths.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue  # pruned by another process
+    return [path for _, path in sorted(paths)]
+
+
+def save_profile(profiler, view):
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{view}-{datetime.now():%Y%m%dT%H%M%S%f}-{os.getpid()}.prof'
+    profiler.dump_stats(path)
+    keep = getattr(settings, 'PROFILE_KEEP', 200)
+    for old in profiles_by_age(directory)[:-keep]:
+        old.unlink(missing_ok=True)
+    return path.name
+
+
+def top_functions(path, limit=10):
+    stats = pstats.Stats(str(path), stream=io.StringIO())
+    rows = []
+    for (filename, line, function), (_, calls, total_time, cumulative_time, _) in stats.stats.items():
+        rows.append({
+            'function': f'{filename}:{line}({function})',
+            'calls': calls,
+            'total_time': round(total_time, 6),
+            'cumulative_time': round(cumulative_time, 6),
+        })
+    return sorted(rows, key=lambda row: row['cumulative_time'], reverse=True)[:limit]
+
+
+def recent_profiles(limit=20, view=None, top=10):
+    directory = profile_dir()
+    profiles = []
+    for path in reversed(profiles_by_age(directory) if directory.exists() else []):
+        match = re.match(r'(?P<view>.+)-(?P<timestamp>\d{8}T\d{12})-(?P<pid>\d+)\.prof$', path.name)
+        if match is None or (view and match['view'] != view):
+            continue
+        try:
+            functions = top_functions(path, top)
+        except FileNotFoundError:
+            continue
+        profiles.append({
+            'name': path.name,
+            'view': match['view'],
+            'created_at': datetime.strptime(match['timestamp'], '%Y%m%dT%H%M%S%f').isoformat(),
+            'top_functions': functions,
+        })
+        if len(profiles) == limit:
+            break
+    return profiles
@@ -0,0 +1,142 @@
+import json
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api import reports, utils
+from api.models import User
+
+# EXPLAIN every query of api/reports.py and api/utils.py and report sequential scans of large tables. Used by
+# `manage.py check_query_plans` on a database with representative data and by api.tests.QueryPlanTests.
+
+# tables that only hold a handful of rows, scanning them is fine
+SMALL_MODELS = {'configuration', 'sequence'}
+
+
+def report_cases(sample):
+    user, referral = sample['user'], sample['referral']
+    start_date, end_date = sample['start_date'], sample['end_date']
+    user_ids = sample['user_ids']
+    # (name, call, tables the query is meant to read in full)
+    return [
+        ('reports.matching_report', lambda: reports.matching_report(user), set()),
+        ('reports.payout_report', lambda: reports.payout_report(user), set()),
+        ('reports.bulk_payout_report', lambda: reports.bulk_payout_report(),
+         {'api_user', 'api_secondaryrewardpoint', 'api_spotrewardpoint'}),
+        ('reports.dashboard_statistics', lambda: reports.dashboard_statistics(user), set()),
+        ('reports.dashboard_statistics (org)', lambda: reports.dashboard_statistics(), {'api_user'}),
+        ('reports.referral_report', lambda: reports.referral_report(user), set()),
+        ('reports.refresh_referral_reports', lambda: reports.refresh_referral_reports([user.pk]), set()),
+        ('reports.snapshot_referral_report', lambda: reports.snapshot_referral_report(user), set()),
+        ('reports.custom_payout_report', lambda: reports.custom_payout_report(user, start_date, end_date), set()),
+        ('reports.org_payout_report', lambda: list(reports.org_payout_report(start_date, end_date)), {'api_user'}),
+        ('reports.team_details_report', lambda: reports.team_details_report(user), set()),
+        ('reports.team_details_tree_report', lambda: reports.team_details_tree_report(user), set()),
+        ('reports.primary_reward_criteria_status', lambda: reports.primary_reward_criteria_status(user), set()),
+        ('reports.batch_reward_criteria_status',
+         lambda: list(reports.batch_reward_criteria_status(User.objects.filter(pk__in=user_ids))), set()),
+        ('utils.generate_user_id', lambda: utils.generate_user_id(user.date_joined, user.mobile_number), set()),
+        ('utils.allocate_invoice_numbers', lambda: utils.allocate_invoice_numbers(10), set()),
+        # only runs once, to seed the invoice number sequence
+        ('utils.last_invoice_number', lambda: utils.last_invoice_number(), {'api_order'}),
+        ('utils.open_prp_slot', lambda: utils.open_prp_slot(user.pk, referral.pk), set()),
+        ('utils.reward_allocation', lambda: utils.reward_allocation(sample['new_user'], referral), set()),
+        ('utils.reward_counts', lambda: utils.reward_counts(user.pk, user.referral_path, user.referral_depth), set()),
+        ('utils.get_reward_counters', lambda: utils.get_reward_counters(user_ids), set()),
+        ('utils.bump_reward_counter', lambda: utils.bump_reward_counter(user.pk, spot_count=1), set()),
+        ('utils.move_referral_counters',
+         lambda: utils.move_referral_counters(referral.referral_path, referral.referral_path, 1), set()),
+        ('utils.mark_referral_reports_dirty', lambda: utils.mark_referral_reports_dirty(*user_ids), set()),
+    ]
+
+
+def sample_data():
+    # the user with the most direct referrals, one of their referrals and a few more users, None without referrals
+    top = User.objects.exclude(referral=None).values('referral_id').annotate(total=Count('pk')) \
+        .order_by('-total').first()
+    if top is None:
+        return None
+    user = User.objects.get(pk=top['referral_id'])
+    referral = User.objects.filter(referral_id=top['referral_id']).order_by('pk').first()
+    new_user = User.objects.filter(referral=referral).first() or referral
+    today = timezone.now().date()
+    return {
+        'user': user,
+        'referral': referral,
+        'new_user': new_user,
+        'user_ids': [user.pk, referral.pk, new_user.pk],
+        'start_date': str(today - timedelta(days=30)),
+        'end_date': str(today),
+    }
+
+
+def postgresql_scans(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    def walk(node):
+        # an index scan with a Filter but no Index Cond walks the whole index and checks every row, as a Seq Scan
+        filtered_index_scan = node.get('Node Type') in ('Index Scan', 'Index Only Scan') \
+            and 'Filter' in node and 'Index Cond' not in node
+        if node.get('Node Type') == 'Seq Scan' or filtered_index_scan:
+            yield node['Relation Name']
+        for child in node.get('Plans', []):
+            yield from walk(child)
+
+    return list(walk(plan[0]['Plan'])), json.dumps(plan, indent=2)
+
+
+def sqlite_scans(sql):
+    with connection.cursor() as cursor:
+        # lets LIKE 'prefix%' (startswith) use an index, as the text_pattern_ops index does on PostgreSQL
+        cursor.execute('PRAGMA case_sensitive_like = ON')
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        details = [row[-1] for row in cursor.fetchall()]
+        cursor.execute('PRAGMA case_sensitive_like = OFF')
+    # only "SEARCH <table> USING [COVERING] INDEX / INTEGER PRIMARY KEY" reads just the matching rows, a
+    # "SCAN <table>" step may read the whole table or index even with a LIMIT. The one exception is a query
+    # without a WHERE clause that walks the table in rowid order (no temp b-tree) and stops at its LIMIT.
+    if ' LIMIT ' in sql and ' WHERE ' not in sql and not any('TEMP B-TREE' in detail for detail in details):
+        return [], '\n'.join(details)
+    scans = [detail.split()[1] for detail in details if detail.startswith('SCAN ')]
+    return scans, '\n'.join(details)
+
+
+def large_tables():
+    return {model._meta.db_table for model in apps.get_app_config('api').get_models()
+            if model._meta.model_name not in SMALL_MODELS}
+
+
+def explain_queries(call, full_scans=()):
+    # runs call() in a transaction that is rolled back and returns (sql, plan, large tables outside full_scans read
+    # with a sequential scan) for each of its queries, and the exception call() raised, if any
+    explain = postgresql_scans if connection.vendor == 'postgresql' else sqlite_scans
+    tables = large_tables()
+    explained = []
+    error = None
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # on a small database the planner prefers seq scans even where an index exists
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        with CaptureQueriesContext(connection) as queries:
+            try:
+                call()
+            except Exception as e:
+                error = e  # the queries up to the error are still checked
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+                continue
+            scans, plan = explain(sql)
+            bad = sorted({table for table in scans if table in tables and table not in full_scans})
+            explained.append((sql, plan, bad))
+        transaction.set_rollback(True)  # the checked functions may write
+    return explained, error
@@ -1,13 +1,18 @@
+import logging
+import time
 from collections import defaultdict
 from datetime import timedelta, datetime
 
-from django.db import models, connection
-from django.db.models import F
-from django.db.models.functions import Cast
+from django.db import transaction
+from django.db.models import F, Count, Q
+from django.utils import timezone
 
-from api.models import PrimaryRewardPoint, PRPMatching, Configuration, SecondaryRewardPoint, Payout, User, RewardClaim, \
-    Order, SpotRewardPoint
-from api.utils import get_last_saturday
+from api.configuration import reward_points, rpc_values, payout_rates
+from api.models import PrimaryRewardPoint, PRPMatching, SecondaryRewardPoint, Payout, User, RewardClaim, \
+    Order, SpotRewardPoint, Address, ReferralReport, ReferralReportState
+from api.utils import get_last_saturday, get_reward_counters
+
+logger = logging.getLogger(__name__)
 
 
 def matching_report(user):
@@ -25,25 +30,6 @@ def matching_report(user):
     return report_data
 
 
-# Reward Point configurations
-table_exists = 'api_configuration' in connection.introspection.table_names()
-
-if table_exists:
-    config = Configuration.objects.values('config_name', 'value').all()
-
-    if config is not None:
-        config_dict = {data['config_name']: data['value'] for data in config}
-
-        prp = int(config_dict.get('PRP', 0))
-        srp = int(config_dict.get('SRP', 0))
-        irp = int(config_dict.get('IRP', 0))
-
-        # Dynamically fetch and assign values for RPC1, RPC2, RPC3, etc.
-        rpc_values = {key: int(value) for key, value in config_dict.items() if key.startswith('RPC')}
-        for i in range(1, len(rpc_values) + 1):
-            globals()[f'RPC{i}'] = rpc_values.get(f'RPC{i}', 0)
-
-
 # <----.----->
 
 def payout_report(user=None, start_date=None, end_date=None, is_org=False):
@@ -52,6 +38,7 @@ def payout_report(user=None, start_date=None, end_date=None, is_org=False):
         end_date = start_date + timedelta(days=6, hours=23, minutes=59)
 
         if not Payout.objects.filter(start_date=start_date, end_date=end_date, user=user).exists():
+            prp, srp, irp = reward_points()
             primary_rp = PrimaryRewardPoint.objects.filter(date__range=(start_date, end_date))
             secondary_rp = SecondaryRewardPoint.objects.filter(eligible_su=user.pk)
 
@@ -84,39 +71,71 @@ def payout_report(user=None, start_date=None, end_date=None, is_org=False):
         return payouts
 
 
+def bulk_payout_report(start_date=None, batch_size=1000):
+    # Set-based variant of payout_report for every user of the week, counts are grouped in one query each
+    # and the Payout rows are bulk created, users that already have a payout for the week are skipped.
+    started = time.monotonic()
+    start_date = get_last_saturday(start_date)
+    end_date = start_date + timedelta(days=6, hours=23, minutes=59)
+
+    primary_rp = PrimaryRewardPoint.objects.filter(date__range=(start_date, end_date))
+    primary_reward_counts = dict(PRPMatching.objects.filter(PRP_id__date__range=(start_date, end_date))
+                                 .values_list('PRP_id__PRP_user').annotate(Count('pk')))
+    referral_counts = {referred_by: count for referred_by, count in
+                       primary_rp.values_list('referred_by').annotate(Count('pk')) if referred_by is not None}
+    secondary_reward_counts = dict(SecondaryRewardPoint.objects.values_list('eligible_su').annotate(Count('pk')))
+    spot_reward_counts = dict(SpotRewardPoint.objects.values_list('eligible_user').annotate(Count('pk')))
+    existing = set(Payout.objects.filter(start_date=start_date, end_date=end_date).values_list('user_id', flat=True))
+    prp, srp, irp = reward_points()
+    tds, rtl, rps = payout_rates()
+
+    created = 0
+    batch = []
+    for user_id in User.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=batch_size):
+        if user_id in existing:
+            continue
+        primary_reward_count = primary_reward_counts.get(user_id, 0)
+        payout = Payout(user_id=user_id,
+                        start_date=start_date,
+                        end_date=end_date,
+                        prp_team_count=primary_reward_count,
+                        referral_count=referral_counts.get(user_id, 0),
+                        primary_rp=primary_reward_count * prp,
+                        secondary_rp=secondary_reward_counts.get(user_id, 0) * srp,
+                        spot_rp=spot_reward_counts.get(user_id, 0) * irp)
+        payout.apply_deductions(payout.primary_rp + payout.secondary_rp + payout.spot_rp, tds, rtl, rps)
+        batch.append(payout)
+        if len(batch) == batch_size:
+            Payout.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+    if batch:
+        Payout.objects.bulk_create(batch)
+        created += len(batch)
+
+    elapsed = time.monotonic() - started
+    logger.info('Weekly payouts for %s: %d rows in %.2fs (%.0f rows/sec), %d users skipped',
+                start_date.date(), created, elapsed, created / elapsed if elapsed else 0, len(existing))
+    return {'created': created, 'skipped': len(existing), 'seconds': elapsed}
+
+
 def dashboard_statistics(user=None):
     data = {'team_count': 0, }
-    prp_data = PrimaryRewardPoint.objects.all()
     users = User.objects.all()
     if user:
-        secondary_rp = SecondaryRewardPoint.objects.filter(eligible_su=user.pk)
-        data['referral_count'] = User.objects.filter(referral_id=user.pk).count()
-        data['spot_reward'] = SpotRewardPoint.objects.filter(eligible_user=user.pk).count() * irp
-        if user.referral_id:
-            primary_user_down_lines = User.objects.filter(referral_id=user.referral_id)
-            primary_user_down_lines_referral_ids = list(primary_user_down_lines.values_list('pk', flat=True))
-            primary_user_down_lines_referrals = User.objects.filter(
-                referral_id__in=primary_user_down_lines_referral_ids).count()
-            # current_user_down_lines = User.objects.filter(referral_id=user.pk)
-            # current_user_down_lines_referrals = User.objects.filter(referral_id__in=current_user_down_lines).count()
-            # logged-in user is not excluded in the following query
-            # data['team_count'] = prp_data.filter((Q(PRP_user=primary_user.PRP_user.pk) if primary_user else Q()) |
-            #                                      Q(PRP_user=user.pk) |
-            #                                      Q(PRP_user__in=list(primary_user_down_lines)) |
-            #                                      Q(referred_by__in=list(primary_user_down_lines))).count()
-
-            data['team_count'] = primary_user_down_lines.count() + primary_user_down_lines_referrals
-
-        # data['self_count'] = current_user_down_lines.count() + current_user_down_lines_referrals
-
-        # if data['team_count'] != data['self_count']:
-        #     data['senior_support'] = (data['team_count'] - data['self_count'] if data['team_count'] > data[
-        #         'self_count'] else data['self_count'] - data['team_count']) - 1
-        # else:
-        #     data['senior_support'] = 0
-        prp_count = prp_data.filter(PRP_user=user.pk).values_list('pk', flat=True)
-        data['primary_reward'] = PRPMatching.objects.filter(PRP_id__in=prp_count).count() * prp
-        data['secondary_reward'] = secondary_rp.count() * srp
+        prp, srp, irp = reward_points()
+        upline_id = int(user.referral_id) if user.referral_id else None
+        counters = get_reward_counters([user.pk, upline_id] if upline_id else [user.pk])
+        counter = counters[user.pk]
+        data['referral_count'] = counter.referral_count
+        data['spot_reward'] = counter.spot_count * irp
+        if upline_id:
+            # the upline's direct referrals plus their referrals
+            upline_counter = counters[upline_id]
+            data['team_count'] = upline_counter.referral_count + upline_counter.second_level_referral_count
+
+        data['primary_reward'] = counter.prp_match_count * prp
+        data['secondary_reward'] = counter.srp_count * srp
         data['total_reward'] = data['primary_reward'] + data['secondary_reward'] + data['spot_reward']
         data['admin_status'] = user.is_admin
         return data
@@ -131,59 +150,152 @@ def dashboard_statistics(user=None):
         return data
 
 
-def referral_report(user=None):
-    start_date = get_last_saturday()
-    end_date = start_date + timedelta(days=6, hours=23, minutes=59)
-    referrals = User.objects.filter(referral_id=user.pk)
+def weekly_referral_sales(user_ids, start_date, end_date):
+    # PRP rows of the week per direct referral of the given users, counted with one GROUP BY on referred_by
+    sales = PrimaryRewardPoint.objects.filter(date__range=(start_date, end_date),
+                                              referred_by__referral__in=user_ids) \
+        .values_list('referred_by').annotate(total=Count('pk')).order_by()
+    return dict(sales)
 
-    user_sales = defaultdict(int)
 
-    for referral in referrals:
-        total_sales = PrimaryRewardPoint.objects.filter(date__range=(start_date, end_date),
-                                                        referred_by=referral.pk).count()
-        user_sales[referral.pk] += total_sales
-
-    report = []
-    matched_users = set()
-
-    for referral in referrals:
-        user_id = referral.pk
-        if user_id in matched_users:
+def carry_forward_sales(referral_ids, user_sales):
+    # The first referral is matched against every other referral with sales, each of them carries forward
+    # min(first referral's sales, own sales) and is then done. Referrals without sales are never matched
+    # and get an empty row of their own, in referral order. user_sales holds the sales of these referrals only.
+    # Returns (referral, total, considered, carried) rows.
+    rows = []
+    for referral_id in referral_ids:
+        total_sales = user_sales.get(referral_id, 0)
+        if rows and total_sales:
             continue
+        carry_forwarded = 0
+        if not rows:
+            carry_forwarded = sum(min(total_sales, other_sales) for other_id, other_sales in user_sales.items()
+                                  if other_id != referral_id)
+        rows.append((referral_id, total_sales, total_sales - carry_forwarded, carry_forwarded))
+    return rows
 
-        total_sales = user_sales[user_id]
 
-        data = {
-            'user_id': user_id,
-            'name': referral.full_name,
-            'mobile_number': referral.mobile_number.national_number,
-            'total_sales': total_sales,
-            'sales_consider': total_sales,
-            'sales_carry_forwarded': 0,
-        }
+def referral_report_week():
+    start_date = get_last_saturday()
+    return start_date, start_date + timedelta(days=6, hours=23, minutes=59)
 
-        for other_referral in referrals:
-            other_user_id = other_referral.pk
-            if user_id != other_user_id and user_sales[other_user_id] > 0:
-                carry_forwarded = min(total_sales, user_sales[other_user_id])
-                data['sales_consider'] -= carry_forwarded
-                data['sales_carry_forwarded'] += carry_forwarded
-                matched_users.add(other_user_id)
-                user_sales[other_user_id] -= carry_forwarded
 
-        report.append(data)
-        matched_users.add(user_id)
+def referral_report(user=None):
+    start_date, end_date = referral_report_week()
+    referrals = {referral.pk: referral for referral in User.objects.filter(referral_id=user.pk).order_by('pk')
+                 .only('pk', 'full_name', 'mobile_number')}
+    user_sales = weekly_referral_sales([user.pk], start_date, end_date)
+
+    return [{
+        'user_id': referral_id,
+        'name': referrals[referral_id].full_name,
+        'mobile_number': referrals[referral_id].mobile_number.national_number,
+        'total_sales': total_sales,
+        'sales_consider': sales_consider,
+        'sales_carry_forwarded': sales_carry_forwarded,
+    } for referral_id, total_sales, sales_consider, sales_carry_forwarded
+        in carry_forward_sales(referrals.keys(), user_sales)]
+
+
+def refresh_referral_reports(user_ids=None, full=False, chunk_size=500):
+    # Materialize this week's referral report of the given users into ReferralReport. Without user_ids only
+    # the stale reports are rebuilt (dirty, or of an earlier week), `full` rebuilds every user with referrals.
+    started = time.monotonic()
+    start_date, end_date = referral_report_week()
+    if user_ids is None and full:
+        user_ids = sorted(set(User.objects.exclude(referral=None).values_list('referral_id', flat=True)))
+    elif user_ids is None:
+        user_ids = list(ReferralReportState.objects.filter(Q(is_dirty=True) | ~Q(week_start=start_date))
+                        .values_list('user_id', flat=True))
+
+    for i in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[i:i + chunk_size]
+        # cleared before reading so that a change made while the chunk is computed marks it dirty again
+        ReferralReportState.objects.filter(user_id__in=chunk).update(is_dirty=False)
+
+        referrals = defaultdict(list)
+        for referral_id, referrer_id in User.objects.filter(referral__in=chunk).order_by('pk') \
+                .values_list('pk', 'referral_id'):
+            referrals[referrer_id].append(referral_id)
+        user_sales = weekly_referral_sales(chunk, start_date, end_date)
+
+        rows = [ReferralReport(referrer_id=user_id, week_start=start_date, position=position, user_id=referral_id,
+                               total_sales=total_sales, sales_considered=sales_considered,
+                               sales_carry_forwarded=sales_carry_forwarded)
+                for user_id in chunk
+                for position, (referral_id, total_sales, sales_considered, sales_carry_forwarded)
+                in enumerate(carry_forward_sales(referrals[user_id], {
+                    referral_id: user_sales[referral_id] for referral_id in referrals[user_id]
+                    if referral_id in user_sales}))]
+        now = timezone.now()
+        with transaction.atomic():
+            ReferralReport.objects.filter(referrer_id__in=chunk, week_start=start_date).delete()
+            ReferralReport.objects.bulk_create(rows, batch_size=1000)
+            ReferralReportState.objects.bulk_create(
+                [ReferralReportState(user_id=user_id, week_start=start_date, refreshed_at=now) for user_id in chunk],
+                update_conflicts=True, unique_fields=['user'], update_fields=['week_start', 'refreshed_at'])
+
+    logger.info('Refreshed %d referral reports in %.2fs', len(user_ids), time.monotonic() - started)
+    return len(user_ids)
+
+
+def snapshot_referral_report(user):
+    # this week's referral report of the user from ReferralReport, rebuilt first when it is stale
+    start_date, _ = referral_report_week()
+    state = ReferralReportState.objects.filter(user=user).first()
+    if state is None or state.is_dirty or state.week_start != start_date:
+        refresh_referral_reports([user.pk])
+
+    rows = ReferralReport.objects.filter(referrer=user, week_start=start_date).select_related('user') \
+        .only('user__full_name', 'user__mobile_number', 'total_sales', 'sales_considered', 'sales_carry_forwarded') \
+        .order_by('position')
+    return [{
+        'user_id': row.user_id,
+        'name': row.user.full_name,
+        'mobile_number': row.user.mobile_number.national_number,
+        'total_sales': row.total_sales,
+        'sales_consider': row.sales_considered,
+        'sales_carry_forwarded': row.sales_carry_forwarded,
+    } for row in rows]
+
+
+def custom_payout_range(start_date, end_date):
+    start_date = datetime.strptime(start_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0, microsecond=0)
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0, microsecond=0)
 
-    return report
+    end_date = end_date + timedelta(days=1) - timedelta(microseconds=1)
+    return start_date, end_date
 
 
-def custom_payout_report(user=None, start_date=None, end_date=None):
+def custom_payout_data(user, referral_count, primary_reward_count, secondary_reward_count, spot_reward_count,
+                       points=None, rates=None):
+    prp, srp, irp = points or reward_points()
     data = {}
+    data['admin_status'] = user.is_admin
+    data['referral_count'] = referral_count
+    data['primary_reward'] = primary_reward_count * prp
+    data['prp_count'] = primary_reward_count
+    data['secondary_reward'] = secondary_reward_count * srp
+    data['srp_count'] = secondary_reward_count
+    data['spot_reward'] = spot_reward_count * irp
+    data['irp_count'] = spot_reward_count
+
+    values = [value for value in [data['primary_reward'], data['secondary_reward'], data['spot_reward']] if
+              value is not None]
+    gross = sum(values) if values else None
+    data['gross'] = gross
+    tds, rtl, rps = rates or payout_rates()
+    data['TDS'] = gross * tds
+    data['rental'] = gross * rtl
+    data['net'] = gross - (data['TDS'] + data['rental'])
+    data['repurchase'] = data['net'] * rps
+    data['final'] = data['net'] - data['repurchase']
+    return data
 
-    start_date = datetime.strptime(start_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0, microsecond=0)
-    end_date = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0, microsecond=0)
 
-    end_date = end_date + timedelta(days=1) - timedelta(microseconds=1)
+def custom_payout_report(user=None, start_date=None, end_date=None):
+    start_date, end_date = custom_payout_range(start_date, end_date)
 
     if user is not None:
         primary_rp = PrimaryRewardPoint.objects.filter(date__range=(start_date, end_date))
@@ -192,100 +304,127 @@ def custom_payout_report(user=None, start_date=None, end_date=None):
         primary_reward_total = primary_rp.filter(PRP_user=user.pk).values_list('pk', flat=True)
         primary_reward_count = PRPMatching.objects.filter(PRP_id__in=primary_reward_total).count()
         referral_count = primary_rp.filter(referred_by=user.pk).count()
-        primary_reward = primary_reward_count * prp
         secondary_reward_count = secondary_rp.filter(eligible_su=user.pk).count()
         spot_reward_count = SpotRewardPoint.objects.filter(eligible_user=user.pk).count()
 
-        data['admin_status'] = user.is_admin
-        data['referral_count'] = referral_count
-        data['primary_reward'] = primary_reward
-        data['prp_count'] = primary_reward_count
-        data['secondary_reward'] = secondary_reward_count * srp
-        data['srp_count'] = secondary_reward_count
-        data['spot_reward'] = spot_reward_count * irp
-        data['irp_count'] = spot_reward_count
-
-        values = [value for value in [data['primary_reward'], data['secondary_reward'], data['spot_reward']] if
-                  value is not None]
-        gross = sum(values) if values else None
-        data['gross'] = gross
-        config = Configuration.objects.all()
-        tds = config.get(config_name="TDS").decimal_value
-        rtl = config.get(config_name="RTL").decimal_value
-        rps = config.get(config_name="RPS").decimal_value
-        data['TDS'] = gross * tds
-        data['rental'] = gross * rtl
-        data['net'] = gross - (data['TDS'] + data['rental'])
-        data['repurchase'] = data['net'] * rps
-        data['final'] = data['net'] - data['repurchase']
-        return data
+        return custom_payout_data(user, referral_count, primary_reward_count, secondary_reward_count,
+                                  spot_reward_count)
+
+
+def org_payout_report(start_date=None, end_date=None, chunk_size=1000):
+    # custom_payout_report for every user as a generator. Users are read in chunks and each chunk costs four
+    # grouped count queries, so memory stays flat however many users there are.
+    start_date, end_date = custom_payout_range(start_date, end_date)
+    points, rates = reward_points(), payout_rates()
+
+    def report_chunk(users):
+        user_ids = [user.pk for user in users]
+        primary_reward_counts = dict(PRPMatching.objects.filter(PRP_id__date__range=(start_date, end_date),
+                                                                PRP_id__PRP_user__in=user_ids)
+                                     .values_list('PRP_id__PRP_user').annotate(Count('pk')))
+        referral_counts = dict(PrimaryRewardPoint.objects.filter(date__range=(start_date, end_date),
+                                                                 referred_by__in=user_ids)
+                               .values_list('referred_by').annotate(Count('pk')))
+        secondary_reward_counts = dict(SecondaryRewardPoint.objects.filter(date__range=(start_date, end_date),
+                                                                           eligible_su__in=user_ids)
+                                       .values_list('eligible_su').annotate(Count('pk')))
+        spot_reward_counts = dict(SpotRewardPoint.objects.filter(eligible_user__in=user_ids)
+                                  .values_list('eligible_user').annotate(Count('pk')))
+        for user in users:
+            yield user, custom_payout_data(user, referral_counts.get(user.pk, 0),
+                                           primary_reward_counts.get(user.pk, 0),
+                                           secondary_reward_counts.get(user.pk, 0),
+                                           spot_reward_counts.get(user.pk, 0), points, rates)
+
+    def rows():
+        users = []
+        for user in User.objects.order_by('pk').only('pk', 'full_name', 'mobile_number', 'is_admin') \
+                .iterator(chunk_size=chunk_size):
+            users.append(user)
+            if len(users) == chunk_size:
+                yield from report_chunk(users)
+                users = []
+        if users:
+            yield from report_chunk(users)
+
+    return rows()
+
+
+def team_member_extras(current_user):
+    # first address city and first order of every user in current_user's tree, two queries in total
+    cities = {}
+    for user_id, city in Address.objects.filter(user__referral_path__startswith=current_user.referral_path) \
+            .order_by('pk').values_list('user_id', 'city'):
+        cities.setdefault(user_id, city)
+
+    orders = {}
+    for user_id, order_id, total_amount in Order.objects.filter(
+            user__referral_path__startswith=current_user.referral_path) \
+            .order_by('pk').values_list('user_id', 'pk', 'total_amount'):
+        orders.setdefault(user_id, (order_id, total_amount))
+
+    return cities, orders
 
 
 def team_details_report(current_user):
     team_details = []
 
-    def get_user_details(user, level):
-        if level != 0:
-            data = {}
-            data['level'] = level
-            data['user_id'] = user.pk
-            data['name'] = user.full_name
-            data['mobile_number'] = user.mobile_number.national_number
-            data['city'] = user.addresses.first().city if user.addresses.first() else "City Unknown"
-            data['referral'] = user.referral_id
-            data['status'] = "Active" if user.is_active else "Inactive"
-            data['registration_date'] = user.date_joined.date()
-            order = Order.objects.filter(user=user).first()
-            data['order_placed'] = order.total_amount if order is not None else None
-            data['order_id'] = order.pk if order is not None else None
-            data['admin_status'] = user.is_admin
-            team_details.append(data)
+    # whole downline in one indexed prefix scan on the materialized referral path
+    members = current_user.downline().order_by('referral_depth', 'referral_path')
+    cities, orders = team_member_extras(current_user)
+    for user in members:
+        order_id, total_amount = orders.get(user.pk, (None, None))
+        data = {}
+        data['level'] = user.referral_depth - current_user.referral_depth
+        data['user_id'] = user.pk
+        data['name'] = user.full_name
+        data['mobile_number'] = user.mobile_number.national_number
+        data['city'] = cities.get(user.pk, "City Unknown")
+        data['referral'] = str(user.referral_id) if user.referral_id else None
+        data['status'] = "Active" if user.is_active else "Inactive"
+        data['registration_date'] = user.date_joined.date()
+        data['order_placed'] = total_amount
+        data['order_id'] = order_id
+        data['admin_status'] = user.is_admin
+        team_details.append(data)
 
-        # Recursively get user details for the next level
-        referrals = User.objects.filter(referral_id=user.pk)
-        for referral in referrals:
-            get_user_details(referral, level + 1)
+    return team_details
 
-    # Start with level 0 for the current user
-    get_user_details(current_user, level=0)
 
-    sorted_team_details = sorted(team_details, key=lambda x: x['level'])
+def team_details_tree_report(current_user):
+    team_details = []
 
-    return sorted_team_details
+    if current_user is None:
+        return team_details
 
+    cities, orders = team_member_extras(current_user)
 
-def team_details_tree_report(current_user):
     def referral_list(user):
         data = {
             'user_id': user.pk,
             'name': user.full_name,
             'mobile_number': user.mobile_number.national_number,
-            'city': user.addresses.first().city if user.addresses.first() else "City Unknown",
-            'referral': user.referral_id,
+            'city': cities.get(user.pk, "City Unknown"),
+            'referral': str(user.referral_id) if user.referral_id else None,
             'status': "Active" if user.is_active else "Inactive",
             'registration_date': user.date_joined.date(),
             'children': []  # Initialize an empty list for referrals
         }
-        order = Order.objects.filter(user_id=user.pk).first()
-        data['order_placed'] = order.total_amount if order is not None else None
+        data['order_placed'] = orders.get(user.pk, (None, None))[1]
         return data
 
-    def build_team_tree(user):
-        user_data = referral_list(user)
-        referrals = User.objects.filter(referral_id=user.pk)
-
-        for referral in referrals:
-            referral_data = build_team_tree(referral)  # Recursive call to build referral tree
-            user_data['children'].append(referral_data)
-
-        return user_data
-
-    team_details = []
+    # The downline is loaded level by level from a single ordered query, every node is attached to its
+    # already built parent, so the nested structure is assembled in memory without recursion.
+    team_tree = referral_list(current_user)
+    nodes = {current_user.pk: team_tree}
+    for user in current_user.downline().order_by('referral_depth', 'pk'):
+        parent = nodes.get(user.referral_id)
+        if parent is None:
+            continue
+        nodes[user.pk] = referral_list(user)
+        parent['children'].append(nodes[user.pk])
 
-    if current_user is not None:
-        # Build the team tree for the current user
-        team_tree = build_team_tree(current_user)
-        team_details.append(team_tree)
+    team_details.append(team_tree)
 
     return team_details
 
@@ -328,14 +467,12 @@ def team_details_tree_report(current_user):
 #     return response
 
 
-def primary_reward_criteria_status(user):
-    prp_data = PrimaryRewardPoint.objects.filter(PRP_user=user.pk).values_list('pk', flat=True)
-    prp_count = PRPMatching.objects.filter(PRP_id__in=prp_data).count()
-    total_rewards = prp_count * prp
-    claimed_rewards = RewardClaim.objects.filter(user=user.pk).order_by("criteria")
+def reward_criteria_rows(user, prp_match_count, claimed_rewards, prp, rpc_values_):
+    # RPC criteria status of one user from their PRP matching count and RewardClaims (ordered by criteria)
+    total_rewards = prp_match_count * prp
 
     # Create RPC criteria dynamically
-    rpc_criteria = list(rpc_values.keys())
+    rpc_criteria = list(rpc_values_.keys())
 
     RP_complete = [0] * len(rpc_criteria)
     RP_required = [0] * len(rpc_criteria)
@@ -343,7 +480,8 @@ def primary_reward_criteria_status(user):
     claimed_on = [None] * len(rpc_criteria)
     completed_rewards = [None] * len(rpc_criteria)
 
-    for i, criteria in enumerate(claimed_rewards):
+    # claims beyond the configured criteria have no slot to report in
+    for i, criteria in enumerate(claimed_rewards[:len(rpc_criteria)]):
         if criteria.claimed_on and criteria.status == 'claimed':
             completed_rewards[i] = criteria.criteria
             claimed_on[i] = criteria.claimed_on.date()
@@ -355,13 +493,13 @@ def primary_reward_criteria_status(user):
         if reward is not None:
             for j, rpc in enumerate(rpc_criteria):
                 if reward == f'RPC{j + 1}':
-                    completed_rewards[i] = rpc_values[rpc]
-                    total_rewards -= rpc_values[rpc]
-                    RP_complete[j] = rpc_values[rpc]
+                    completed_rewards[i] = rpc_values_[rpc]
+                    total_rewards -= rpc_values_[rpc]
+                    RP_complete[j] = rpc_values_[rpc]
 
     total_rewards_added = False
 
-    for i, criteria in enumerate(list(rpc_values.values())):
+    for i, criteria in enumerate(list(rpc_values_.values())):
         if total_rewards < criteria and RP_complete[i] != criteria:
             RP_required[i] = criteria - total_rewards
             if not total_rewards_added:
@@ -376,7 +514,7 @@ def primary_reward_criteria_status(user):
         data = {}
         data['mobile_number'] = user.mobile_number.national_number
         data['name'] = user.full_name
-        data['RP_criteria'] = list(rpc_values.values())[i]
+        data['RP_criteria'] = list(rpc_values_.values())[i]
         data['RP_complete'] = RP_complete[i]
         data['RP_required'] = RP_required[i]
         data['Status'] = status[i]
@@ -384,3 +522,40 @@ def primary_reward_criteria_status(user):
         result.append(data)
 
     return result
+
+
+def primary_reward_criteria_status(user):
+    prp_count = PRPMatching.objects.filter(PRP_id__PRP_user=user.pk).count()
+    claimed_rewards = list(RewardClaim.objects.filter(user=user.pk).order_by("criteria", "pk"))
+    return reward_criteria_rows(user, prp_count, claimed_rewards, reward_points()[0], rpc_values())
+
+
+def batch_reward_criteria_status(users=None, chunk_size=1000):
+    # primary_reward_criteria_status of many users (all by default) as a generator of (user, rows). Each chunk
+    # of users costs one grouped PRPMatching count and one RewardClaim fetch.
+    prp, rpc_values_ = reward_points()[0], rpc_values()
+    if users is None:
+        users = User.objects.all()
+
+    def criteria_chunk(users):
+        user_ids = [user.pk for user in users]
+        prp_match_counts = dict(PRPMatching.objects.filter(PRP_id__PRP_user__in=user_ids)
+                                .values_list('PRP_id__PRP_user').annotate(Count('pk')).order_by())
+        claimed_rewards = defaultdict(list)
+        for claim in RewardClaim.objects.filter(user__in=user_ids).order_by('user', 'criteria', 'pk'):
+            claimed_rewards[claim.user_id].append(claim)
+        for user in users:
+            yield user, reward_criteria_rows(user, prp_match_counts.get(user.pk, 0), claimed_rewards[user.pk],
+                                             prp, rpc_values_)
+
+    def rows():
+        chunk = []
+        for user in users.order_by('pk').only('pk', 'full_name', 'mobile_number').iterator(chunk_size=chunk_size):
+            chunk.append(user)
+            if len(chunk) == chunk_size:
+                yield from criteria_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from criteria_chunk(chunk)
+
+    return rows()
@@ -1,15 +1,18 @@
 from decimal import Decimal
 
 from django.contrib.auth import get_user_model
+from django.db import models, transaction
 from rest_framework import serializers
 
+from .jobs import enqueue_reward_matching
 from .models import User, OrderItem, Address, Order, PrimaryRewardPoint, PRPMatching, SecondaryRewardPoint, Payout, \
     BankDetail, KYCImage, SpotRewardPoint
-from .utils import reward_allocation
+from .utils import reward_allocation, bump_reward_counter, move_referral_counters, mark_referral_reports_dirty
 
 User = get_user_model()
 
 
+@transaction.atomic
 def reward_matching(user):
     # Reward logic
     referred_user = User.objects.filter(pk=user.referral_id).first()
@@ -17,23 +20,55 @@ def reward_matching(user):
     prp_serializer = PrimaryRewardPointSerializer(data=reward_allocation_)
     prp_serializer.is_valid(raise_exception=True)
     prp_serializer.save()
+    mark_referral_reports_dirty(referred_user.referral_id)  # a sale of one of their referrals
     if reward_allocation_['matching_user2'] is not None:
         reward_allocation_['PRP_id'] = prp_serializer.instance.pk
         prp_matching = PRPMatchingSerializer(data=reward_allocation_)
         prp_matching.is_valid(raise_exception=True)
         prp_matching.save()
+        bump_reward_counter(reward_allocation_['PRP_user'], prp_match_count=1)
         if reward_allocation_['secondary_match'] is not None:
             srp_matching = SecondaryRewardPointSerializer(data=reward_allocation_)
             srp_matching.is_valid(raise_exception=True)
             srp_matching.save()
+            bump_reward_counter(reward_allocation_['eligible_su'], srp_count=1)
+
+
+def referrer_numbers(context):
+    # referral_id -> referrer's national number, memoized on the request (or the serializer context without one)
+    request = context.get('request')
+    if request is None:
+        return context.setdefault('referrer_numbers', {})
+    if not hasattr(request, '_referrer_numbers'):
+        request._referrer_numbers = {}
+    return request._referrer_numbers
+
+
+def resolve_referrers(users, context):
+    memo = referrer_numbers(context)
+    missing = {str(user.referral_id) for user in users if user.referral_id and str(user.referral_id) not in memo}
+    if missing:
+        for referrer in User.objects.filter(pk__in=missing).only('pk', 'mobile_number'):
+            memo[str(referrer.pk)] = referrer.mobile_number.national_number
+    return memo
+
+
+class UserListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.Manager) else data)
+        resolve_referrers(users, self.context)  # one query for every referrer in the batch
+        return super().to_representation(users)
 
 
 class UserSerializer(serializers.ModelSerializer):
+    referral_id = serializers.CharField(required=False, allow_null=True)
+
     class Meta:
         model = User
         fields = (
             'id', 'full_name', 'email', 'birth_date', 'gender', 'mobile_number', 'referral_id', 'pan', 'is_updated',
             'is_admin', 'is_free')
+        list_serializer_class = UserListSerializer
 
     def create(self, validated_data):
         user = User(**validated_data)
@@ -41,8 +76,11 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
     def update(self, instance, validated_data):
+        old_referral_path = instance.referral_path
+        old_referral_id = instance.referral_id
         if "referred_user" in self.context.keys():
             instance.referral_id = self.context['referred_user']
+            instance.sync_referral_path()
         if 'is_free' in validated_data.keys():
             instance.is_free = True if validated_data['is_free'] else False
         instance.full_name = validated_data.get('full_name', instance.full_name)
@@ -52,13 +90,19 @@ class UserSerializer(serializers.ModelSerializer):
         instance.pan = validated_data.get('pan', instance.pan)
         instance.is_updated = True
         instance.save()
+        if instance.referral_path != old_referral_path:
+            move_referral_counters(old_referral_path, instance.referral_path,
+                                   User.objects.filter(referral_id=instance.pk).count())
+        if str(instance.referral_id) != str(old_referral_id):
+            mark_referral_reports_dirty(old_referral_id, instance.referral_id)
         return instance
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         if instance.referral_id:
-            serializer = User.objects.get(pk=instance.referral_id)
-            representation['referral_id'] = serializer.mobile_number.national_number
+            referrers = resolve_referrers([instance], self.context)
+            if str(instance.referral_id) in referrers:
+                representation['referral_id'] = referrers[str(instance.referral_id)]
         return representation
 
 
@@ -113,6 +157,13 @@ class SpotRewardPointSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class OrderListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        orders = list(data.all() if isinstance(data, models.Manager) else data)
+        resolve_referrers([order.user for order in orders], self.context)
+        return super().to_representation(orders)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     order_items = OrderItemSerializer(many=True)
     shipping_address = AddressSerializer()
@@ -122,6 +173,7 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ('order_id', 'invoice_number', 'total_amount', "total_tax", "shipping_address", 'order_items', 'user',
                   'delivered_on', 'delivery_partner', 'payment_status', 'payment_method')
+        list_serializer_class = OrderListSerializer
 
     def create(self, validated_data):
         request = self.context.get('request')
@@ -147,7 +199,7 @@ class OrderSerializer(serializers.ModelSerializer):
         instance.save()
         if instance.payment_status and instance.payment_status == 'completed':
             if instance.user.referral_id is not None:
-                reward_matching(instance.user)
+                enqueue_reward_matching(instance)
 
         return instance
 
@@ -155,7 +207,7 @@ class OrderSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
 
         if isinstance(instance, Order) and 'request' in self.context:
-            serializer = UserSerializer(self.context['request'].user)
+            serializer = UserSerializer(self.context['request'].user, context=self.context)
             representation['user'] = serializer.data
             # Add the updated total_amount and total_tax to the representation      #to be commented out in next release
             representation['total_amount'] = instance.total_amount
@@ -0,0 +1,122 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+
+from core.cache import cache_lock
+
+# Statements slower than SLOW_QUERY_THRESHOLD_MS are kept in a ring buffer of SLOW_QUERY_BUFFER_SIZE slots in the
+# SLOW_QUERY_CACHE cache, with the view and the api/ call site that ran them, and their parameters with
+# SLOW_QUERY_CAPTURE_PARAMS. With SLOW_QUERY_EXPLAIN the plan is stored too, EXPLAIN ANALYZE on PostgreSQL (SELECT
+# statements only, it runs the statement again) and EXPLAIN QUERY PLAN on SQLite. `manage.py dump_slow_queries`
+# prints the buffer.
+COUNTER_KEY = 'slow_queries:next'
+SLOT_KEY = 'slow_queries:{}'
+
+# the call site is the innermost frame in these files, or else the innermost frame in the api package
+CALL_SITE_FILES = ('reports.py', 'utils.py', 'serializers.py')
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+SKIPPED_FILES = {os.path.join(API_DIR, 'middleware.py'), os.path.abspath(__file__)}
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def slow_query_cache():
+    return caches[getattr(settings, 'SLOW_QUERY_CACHE', 'default')]
+
+
+def threshold():
+    # seconds, None when the recorder is off
+    threshold_ms = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+    return threshold_ms / 1000 if threshold_ms else None
+
+
+def call_site():
+    fallback = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if os.path.dirname(filename) == API_DIR and filename not in SKIPPED_FILES:
+            site = f'api/{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+            if os.path.basename(filename) in CALL_SITE_FILES:
+                return site
+            fallback = fallback or site
+        frame = frame.f_back
+    return fallback
+
+
+def explain(connection, sql, params):
+    if connection.vendor == 'postgresql':
+        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+        statement = f'EXPLAIN (ANALYZE, BUFFERS) {sql}'
+    elif connection.vendor == 'sqlite':
+        statement = f'EXPLAIN QUERY PLAN {sql}'
+    else:
+        return None
+    _local.explaining = True
+    try:
+        # a failing EXPLAIN must not abort the request's transaction
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(statement, params)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+    except DatabaseError as e:
+        return f'EXPLAIN failed: {type(e).__name__}'
+    finally:
+        _local.explaining = False
+
+
+def explaining():
+    return getattr(_local, 'explaining', False)
+
+
+def record_slow_query(connection, sql, params, many, duration, view):
+    if explaining():
+        return
+    entry = {
+        'recorded_at': time.time(),
+        'duration_ms': round(duration * 1000, 2),
+        'view': view,
+        'call_site': call_site(),
+        'database': connection.alias,
+        'sql': sql,
+        'params': None,
+        'plan': None,
+    }
+    if getattr(settings, 'SLOW_QUERY_CAPTURE_PARAMS', False):
+        entry['params'] = repr(params)[:2000]
+    if getattr(settings, 'SLOW_QUERY_EXPLAIN', False) and not many:
+        entry['plan'] = explain(connection, sql, params)
+    logger.warning('Slow query %.1f ms in %s (%s): %s', entry['duration_ms'], view, entry['call_site'], sql[:500])
+    try:
+        cache = slow_query_cache()
+        # incr is a get and a set on the file based cache, two writers could take the same slot without the lock
+        with cache_lock(cache, COUNTER_KEY):
+            try:
+                slot = cache.incr(COUNTER_KEY)
+            except ValueError:
+                cache.set(COUNTER_KEY, 1, None)
+                slot = 1
+        cache.set(SLOT_KEY.format(slot % getattr(settings, 'SLOW_QUERY_BUFFER_SIZE', 200)), entry, None)
+    except Exception:
+        logger.exception('Could not store the slow query')
+
+
+def recent_slow_queries():
+    cache = slow_query_cache()
+    size = getattr(settings, 'SLOW_QUERY_BUFFER_SIZE', 200)
+    entries = cache.get_many([SLOT_KEY.format(slot) for slot in range(size)]).values()
+    return sorted(entries, key=lambda entry: entry['recorded_at'], reverse=True)
+
+
+def clear_slow_queries():
+    cache = slow_query_cache()
+    size = getattr(settings, 'SLOW_QUERY_BUFFER_SIZE', 200)
+    cache.delete_many([COUNTER_KEY] + [SLOT_KEY.format(slot) for slot in range(size)])
@@ -0,0 +1,120 @@
+import logging
+import threading
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from api.models import SMSOutbox
+
+logger = logging.getLogger(__name__)
+
+# SMS are written to the SMSOutbox table by the request and sent by `manage.py send_sms` (or the per-minute
+# cron fallback), so a slow gateway never holds up an API worker. Senders share one keep-alive session per
+# process, every request has a connect/read timeout and a message is retried SMS_MAX_ATTEMPTS times at most.
+_session_lock = threading.Lock()
+_session = None
+
+
+def gateway_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.SMS_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def send_sms(destination, message):
+    params = {
+        "username": settings.SMS_GATEWAY_USERNAME,
+        "password": settings.SMS_GATEWAY_PASSWORD,
+        "type": 0,
+        "dlr": 1,
+        "destination": destination,
+        "source": "MERKAM",
+        "message": message,
+        "entityid": "1101582610000072947",
+        "tempid": "1107169529512884414"
+    }
+    response = gateway_session().get(settings.SMS_GATEWAY_URL, params=params, timeout=settings.SMS_TIMEOUT)
+    response.raise_for_status()
+
+    # The response may contain useful information, such as the message ID, which you can extract if needed.
+    return response.json().get("messageId")
+
+
+def queue_sms(destination, message, expires_at=None):
+    return SMSOutbox.objects.create(destination=destination, message=message, expires_at=expires_at)
+
+
+def queue_otp_sms(mobile_number, otp, expires_at=None):
+    message = f"Dear User, Your one-time password {otp} is valid for 10 minutes. Do not share with anyone. " \
+              f"Thank You, Team Merka Marketing."
+    return queue_sms(mobile_number, message, expires_at)
+
+
+def claim_sms(batch_size):
+    now = timezone.now()
+    # messages of a sender that died mid-request go back to the queue
+    SMSOutbox.objects.filter(status='sending', locked_at__lt=now - timedelta(seconds=settings.SMS_LOCK_TIMEOUT)) \
+        .update(status='pending')
+    # an OTP that can no longer be used is not worth sending
+    SMSOutbox.objects.filter(status='pending', expires_at__lt=now).update(status='expired', message="")
+
+    claimed = []
+    candidates = SMSOutbox.objects.filter(status='pending', send_after__lte=now).order_by('pk') \
+        .values_list('pk', flat=True)[:batch_size]
+    for pk in candidates:
+        # conditional update, only one sender wins a row
+        if SMSOutbox.objects.filter(pk=pk, status='pending') \
+                .update(status='sending', locked_at=now, attempts=F('attempts') + 1):
+            claimed.append(pk)
+    return list(SMSOutbox.objects.filter(pk__in=claimed).order_by('pk'))
+
+
+def owned(sms):
+    # the message as long as this sender holds it, a sender that claimed it again after SMS_LOCK_TIMEOUT bumped attempts
+    return SMSOutbox.objects.filter(pk=sms.pk, status='sending', attempts=sms.attempts)
+
+
+def dispatch_sms(sms):
+    # the lock is renewed right before the request, so it only has to outlast one send and not the whole batch. A
+    # message that was put back and claimed by another sender in the meantime is left to that sender.
+    if not owned(sms).update(locked_at=timezone.now()):
+        return False
+    try:
+        message_id = send_sms(sms.destination, sms.message)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # the request url carries the gateway password and the OTP, only the kind of error is kept
+        response = getattr(e, 'response', None)
+        error = f'{type(e).__name__} {response.status_code}' if response is not None else type(e).__name__
+        failed = sms.attempts >= settings.SMS_MAX_ATTEMPTS
+        owned(sms).update(
+            status='failed' if failed else 'pending', last_error=error,
+            message="" if failed else sms.message,
+            send_after=timezone.now() + timedelta(seconds=2 ** sms.attempts))
+        logger.warning('Error sending SMS %s (attempt %d): %s', sms.pk, sms.attempts, error)
+        return False
+    # the message holds the OTP, it is not kept once delivered
+    owned(sms).update(status='sent', sent_at=timezone.now(), message_id=message_id, message="", last_error="")
+    return True
+
+
+def dispatch_pending_sms(batch_size=10):
+    # send queued messages until the outbox is drained and return the number of messages handled
+    processed = 0
+    while True:
+        batch = claim_sms(batch_size)
+        if not batch:
+            return processed
+        for sms in batch:
+            dispatch_sms(sms)
+        processed += len(batch)
@@ -1,3 +1,392 @@
-from django.test import TestCase
+import contextlib
+import io
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from psycopg2 import OperationalError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import metrics
+from api.backfills import backfill_user_references
+from api.jobs import JOB_HANDLERS, claim_next_job, enqueue_job, run_job
+from api.models import Job, Order, PrimaryRewardPoint, Sequence, SMSOutbox, User
+from api.query_plans import explain_queries, report_cases, sample_data
+from api.slow_queries import record_slow_query, recent_slow_queries
+from api.sms import claim_sms, dispatch_sms, queue_sms
+from api.utils import allocate_invoice_numbers, allocate_sequence, hash_otp
+from core.db.backends.postgresql_pool.pool import ConnectionPool, PoolTimeout, close_pool, get_pool
+
+
+def run_in_threads(work, workers=8, iterations=25):
+    # work(worker, iteration) in `workers` threads with a database connection each, returns the results and errors
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def loop(worker):
+        try:
+            for iteration in range(iterations):
+                value = work(worker, iteration)
+                with lock:
+                    results.append(value)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=loop, args=(worker,)) for worker in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_invoice_numbers_are_unique_and_gapless(self):
+        user = User.objects.create(mobile_number='+919000000001')
+
+        def checkout(worker, iteration):
+            # every other worker takes blocks for the bulk order paths
+            if worker % 2:
+                return allocate_invoice_numbers(3)
+            return [Order.objects.create(user=user, total_amount=Decimal('0')).invoice_number]
+
+        results, errors = run_in_threads(checkout)
+        self.assertEqual(errors, [])
+        numbers = sorted(int(number[1:]) for block in results for number in block)
+        self.assertEqual(len(numbers), 4 * 25 + 4 * 25 * 3)  # single orders + blocks of 3
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + len(numbers))))
+
+    def test_user_ids_are_unique_and_gapless(self):
+        def signup(worker, iteration):
+            user = User.objects.create(mobile_number=f'+9170{worker:02d}{iteration:06d}')
+            # the pk is "<national number><sequence>", see generate_user_id
+            return int(str(user.pk)[len(str(user.mobile_number.national_number)):])
+
+        sequences, errors = run_in_threads(signup)
+        self.assertEqual(errors, [])
+        sequences.sort()
+        self.assertEqual(sequences, list(range(sequences[0], sequences[0] + 8 * 25)))
+
+
+class ReferralTests(TestCase):
+    def test_referrer_in_own_downline_is_rejected(self):
+        root = User.objects.create(mobile_number='+919000000001')
+        child = User.objects.create(mobile_number='+919000000002', referral=root)
+        grandchild = User.objects.create(mobile_number='+919000000003', referral=child)
+        client = APIClient()
+        client.force_authenticate(child)
+        for mobile_number in ['9000000002', '9000000003']:
+            response = client.patch(reverse('user-details'), {'referral_id': mobile_number}, format='json')
+            self.assertEqual(response.status_code, 400, mobile_number)
+        self.assertEqual(User.objects.get(pk=grandchild.pk).referral_path, f'/{root.pk}/{child.pk}/{grandchild.pk}/')
+
+        client.force_authenticate(grandchild)
+        response = client.patch(reverse('user-details'), {'referral_id': '9000000001'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.objects.get(pk=grandchild.pk).referral_path, f'/{root.pk}/{grandchild.pk}/')
+
+
+class UserReferenceBackfillTests(TestCase):
+    def test_interrupted_backfill_resumes(self):
+        root = User.objects.create(mobile_number='+919000000001')
+        other = User.objects.create(mobile_number='+919000000002')
+        legacy = {'+919000000003': str(root.pk), '+919000000004': '', '+919000000005': 'abc',
+                  '+919000000006': '999', '+919000000007': str(other.pk)}
+        users = {mobile_number: User.objects.create(mobile_number=mobile_number, referral_id_legacy=value)
+                 for mobile_number, value in legacy.items()}
+        prp = PrimaryRewardPoint.objects.create(PRP_user=root, referred_by_legacy=str(other.pk), new_user_legacy='1x')
+
+        def referrals():
+            return {mobile_number: User.objects.get(pk=user.pk).referral_id for mobile_number, user in users.items()}
+
+        # stopped after the first batch of users, which is committed ('+919000000003' and '+919000000005', the
+        # pk starts with the mobile number)
+        with self.assertRaises(RuntimeError):
+            backfill_user_references(apps, batch_size=2, log=mock.Mock(side_effect=RuntimeError))
+        self.assertEqual(referrals(), {'+919000000003': root.pk, '+919000000004': None, '+919000000005': None,
+                                       '+919000000006': None, '+919000000007': None})
+
+        results = backfill_user_references(apps, batch_size=2)
+        self.assertEqual(results[('User', 'referral')], (1, 2))
+        self.assertEqual(results[('PrimaryRewardPoint', 'referred_by')], (1, 0))
+        self.assertEqual(results[('PrimaryRewardPoint', 'new_user')], (0, 1))
+        self.assertEqual(referrals(), {'+919000000003': root.pk, '+919000000004': None, '+919000000005': None,
+                                       '+919000000006': None, '+919000000007': other.pk})
+        prp.refresh_from_db()
+        self.assertEqual((prp.referred_by_id, prp.new_user_id), (other.pk, None))
+
+        # nothing left but the values that match no user
+        self.assertEqual(backfill_user_references(apps, batch_size=2)[('User', 'referral')], (0, 2))
+
+
+def allocate_sequence_job(sequence):
+    allocate_sequence(sequence)
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        handlers = mock.patch.dict(JOB_HANDLERS, {'test_allocate_sequence': (allocate_sequence_job, 'test')})
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    def claim_twice(self):
+        # the first worker's lock times out while its handler still runs and a second worker claims the job
+        enqueue_job('test_allocate_sequence', 'test_allocate_sequence:1', sequence='test_job')
+        first = claim_next_job('test')
+        Job.objects.filter(pk=first.pk).update(
+            locked_at=timezone.now() - timedelta(seconds=settings.JOB_LOCK_TIMEOUT + 1))
+        second = claim_next_job('test')
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(second.attempts, first.attempts + 1)
+        return first, second
+
+    def assertRanOnce(self, job):
+        self.assertEqual(Sequence.objects.get(name='test_job').last_value, 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'done')
+
+    def test_reclaimed_job_finishing_last_is_rolled_back(self):
+        first, second = self.claim_twice()
+        self.assertTrue(run_job(second))
+        self.assertFalse(run_job(first))
+        self.assertRanOnce(first)
+
+    def test_reclaimed_job_finishing_first_is_rolled_back(self):
+        first, second = self.claim_twice()
+        self.assertFalse(run_job(first))
+        self.assertEqual(Job.objects.get(pk=first.pk).status, 'running')
+        self.assertTrue(run_job(second))
+        self.assertRanOnce(first)
+
+
+class SMSOutboxTests(TestCase):
+    def test_message_claimed_again_is_sent_once(self):
+        queue_sms('+919000000001', 'Your one-time password is 1234')
+        first, = claim_sms(10)
+        # the first sender is still busy with the messages before it when its lock times out
+        SMSOutbox.objects.filter(pk=first.pk).update(
+            locked_at=timezone.now() - timedelta(seconds=settings.SMS_LOCK_TIMEOUT + 1))
+        second, = claim_sms(10)
+        with mock.patch('api.sms.send_sms', return_value='1') as send_sms:
+            self.assertFalse(dispatch_sms(first))
+            self.assertTrue(dispatch_sms(second))
+        self.assertEqual(send_sms.call_count, 1)
+        self.assertEqual(SMSOutbox.objects.get(pk=first.pk).status, 'sent')
+
+
+class OTPStoreTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        # a culling cache with MAX_ENTRIES 20 would delete a third of the pending challenges on every further one
+        otp_cache = {**settings.CACHES['otp'], 'LOCATION': cache_dir, 'OPTIONS': {'MAX_ENTRIES': 20}}
+        override = override_settings(CACHES={**settings.CACHES, 'otp': otp_cache}, OTP_STORE='api.otp.CacheOTPStore')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_challenges_beyond_max_entries_all_verify(self):
+        mobile_numbers = [f'+91800000{i:04d}' for i in range(60)]
+        with mock.patch('api.views.generate_otp', return_value=('1234', hash_otp('1234'))), \
+                contextlib.redirect_stdout(io.StringIO()):  # the view prints the OTP
+            auth_hashes = [self.client.post('/otp/generate/', {'mobile_number': mobile_number},
+                                            content_type='application/json').json()['hash']
+                           for mobile_number in mobile_numbers]
+        for mobile_number, auth_hash in zip(mobile_numbers, auth_hashes):
+            response = self.client.post('/otp/verify/', {'mobile_number': mobile_number, 'otp': '1234',
+                                                         'hash': auth_hash}, content_type='application/json')
+            self.assertEqual(response.status_code, 200, response.json())
+
+
+class RewardCriteriaReportTests(TestCase):
+    def test_invalid_user_ids(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(mobile_number='+919000000001', is_admin=True))
+        for user_ids in ['1,abc', '1,,2', '-1', str(2 ** 63)]:
+            response = client.get(reverse('reward_criteria_report'), {'user_ids': user_ids})
+            self.assertEqual(response.status_code, 400, user_ids)
+        self.assertEqual(client.get(reverse('reward_criteria_report'), {'user_ids': '1,2'}).status_code, 200)
+
+
+class ProfileListTests(TestCase):
+    def test_invalid_limit_and_top(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(mobile_number='+919000000001', is_admin=True))
+        for params in [{'limit': 'abc'}, {'top': '1.5'}, {'limit': ''}]:
+            self.assertEqual(client.get(reverse('profile-list'), params).status_code, 400, params)
+        with mock.patch('api.views.recent_profiles', return_value=[]) as recent_profiles:
+            for params in [{'limit': '-5', 'top': '0'}, {'limit': '1000', 'top': '1000'}]:
+                self.assertEqual(client.get(reverse('profile-list'), params).status_code, 200, params)
+        self.assertEqual([call.args[::2] for call in recent_profiles.call_args_list], [(1, 1), (200, 100)])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'plans are checked with enable_seqscan = off on PostgreSQL')
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_data', users=300, stdout=io.StringIO())
+
+    def test_no_sequential_scans(self):
+        for name, call, full_scans in report_cases(sample_data()):
+            with self.subTest(name):
+                explained, error = explain_queries(call, full_scans)
+                self.assertIsNone(error)
+                self.assertTrue(explained)
+                for sql, plan, tables in explained:
+                    self.assertEqual(tables, [], f'sequential scan of {", ".join(tables)}: {sql}\n{plan}')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'the pooled backend is PostgreSQL only')
+class ConnectionPoolTests(TestCase):
+    def pool(self, **options):
+        pool = ConnectionPool(connection.get_connection_params(), **{'timeout': 0.1, **options})
+        self.addCleanup(pool.close)
+        return pool
+
+    def backend_pid(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_checkout_and_checkin(self):
+        pool = self.pool(max_size=2)
+        first = pool.checkout()
+        with first.cursor() as cursor:
+            cursor.execute('SELECT 1')  # opens a transaction, rolled back on checkin
+        pool.checkin(first)
+        self.assertIs(pool.checkout(), first)
+        self.assertEqual(first.info.transaction_status, 0)  # idle
+        second = pool.checkout()
+        self.assertIsNot(second, first)
+        with self.assertRaises(PoolTimeout):
+            pool.checkout()
+        pool.checkin(second)
+        self.assertIs(pool.checkout(), second)
+        self.assertEqual(pool.stats()['opened'], 2)
+
+    def test_max_lifetime(self):
+        pool = self.pool(max_lifetime=60)
+        first = pool.checkout()
+        pool.checkin(first)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            # aged out while idle
+            second = pool.checkout()
+            self.assertIsNot(second, first)
+            self.assertTrue(first.closed)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 2 * 61):
+            # aged out while checked out
+            pool.checkin(second)
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.stats(), {'size': 0, 'idle': 0, 'in_use': 0, 'opened': 2, 'closed': 2})
+
+    def test_broken_connection(self):
+        pool = self.pool(check_interval=0)
+        killer = pool.checkout()
+        first = pool.checkout()
+        pool.checkin(first)
+        with killer.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [self.backend_pid(first)])
+        # the ping finds the idle connection dead
+        second = pool.checkout()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+
+        # a connection that broke while it was checked out is not given back
+        with killer.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [self.backend_pid(second)])
+        with self.assertRaises(OperationalError), second.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        pool.checkin(second)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertEqual(pool.stats()['closed'], 2)
+
+    def test_pools_per_database_and_close(self):
+        params = connection.get_connection_params()
+        pool = get_pool('pool_test', params, {})
+        self.addCleanup(close_pool, 'pool_test')
+        self.assertIs(get_pool('pool_test', dict(params), {}), pool)
+        self.assertIsNot(get_pool('pool_test', {**params, 'dbname': 'other'}, {}), pool)
+
+        idle, in_use = pool.checkout(), pool.checkout()
+        pool.checkin(idle)
+        close_pool('pool_test')
+        self.assertTrue(idle.closed)
+        self.assertFalse(in_use.closed)
+        pool.checkin(in_use)
+        self.assertTrue(in_use.closed)
+        self.assertIsNot(get_pool('pool_test', params, {}), pool)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        metrics_cache = {**settings.CACHES['metrics'], 'LOCATION': cache_dir}
+        override = override_settings(CACHES={**settings.CACHES, 'metrics': metrics_cache}, METRICS_TOKEN='')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get_metrics(self, authorization=None):
+        headers = {'HTTP_AUTHORIZATION': authorization} if authorization else {}
+        return self.client.get('/metrics', **headers).status_code
+
+    def test_requires_token_or_admin(self):
+        user = User.objects.create(mobile_number='+919000000001')
+        admin = User.objects.create(mobile_number='+919000000002', is_admin=True)
+        self.assertEqual(self.get_metrics(), 403)
+        self.assertEqual(self.get_metrics(f'Bearer {AccessToken.for_user(user)}'), 403)
+        self.assertEqual(self.get_metrics(f'Bearer {AccessToken.for_user(admin)}'), 200)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.get_metrics('Bearer wrong'), 403)
+            self.assertEqual(self.get_metrics('Bearer secret'), 200)
+
+    def test_stopped_process_drops_out(self):
+        with mock.patch('api.metrics.process_key', return_value='metrics:host:1'):
+            metrics.flush()
+        with mock.patch('api.metrics.process_key', return_value='metrics:host:2'):
+            metrics.flush()
+        self.assertEqual(set(metrics.metrics_cache().get(metrics.REGISTRY_KEY)), {'metrics:host:1', 'metrics:host:2'})
+
+        # process 1 stopped flushing, process 2 flushes again after the snapshot lifetime
+        later = time.time() + settings.METRICS_FLUSH_INTERVAL * metrics.SNAPSHOT_TTL_INTERVALS + 1
+        with mock.patch('api.metrics.process_key', return_value='metrics:host:2'), \
+                mock.patch('time.time', return_value=later):
+            metrics.flush()
+            self.assertEqual(set(metrics.metrics_cache().get(metrics.REGISTRY_KEY)), {'metrics:host:2'})
+            self.assertIsNone(metrics.metrics_cache().get('metrics:host:1'))
+
+
+class SlowQueryTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        slow_query_cache = {**settings.CACHES['slow_queries'], 'LOCATION': cache_dir}
+        override = override_settings(CACHES={**settings.CACHES, 'slow_queries': slow_query_cache})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_concurrent_writers_take_distinct_slots(self):
+        def record(worker, iteration):
+            record_slow_query(connection, 'SELECT %s', ['+919000000001'], False, 1.0, f'View{worker}')
+
+        with self.assertLogs('api.slow_queries', 'WARNING'):
+            _, errors = run_in_threads(record, workers=4, iterations=25)
+        self.assertEqual(errors, [])
+        entries = recent_slow_queries()
+        self.assertEqual(len(entries), 100)
+        self.assertEqual({entry['params'] for entry in entries}, {None})
@@ -2,7 +2,8 @@ from django.urls import path
 
 from .views import GenerateOTPAPIView, VerifyOTPAPIView, UserDetailsAPIView, RefreshTokenAPIView, CreateOrderView, \
     CreatePayoutView, PayoutReportView, DashboardView, TeamDetailsView, RewardReportView, FetchUserView, OrderList, \
-    OrderDetail, BankDetailListCreateView, KYCImageView, ReferralReportView, TeamDetailsTreeView, OrderUpdateView
+    OrderDetail, BankDetailListCreateView, KYCImageView, ReferralReportView, TeamDetailsTreeView, OrderUpdateView, \
+    RewardCriteriaReportView, ProfileListView, ProfileDownloadView
 
 urlpatterns = [
     path('otp/generate/', GenerateOTPAPIView.as_view(), name='generate_otp'),
@@ -13,6 +14,7 @@ urlpatterns = [
     path('create-payout/', CreatePayoutView.as_view(), name='create_payout'),
     path('payout-report/', PayoutReportView.as_view(), name='payout_report'),  # to be removed
     path('reward-report/', RewardReportView.as_view(), name='payout_report'),
+    path('reward-criteria-report/', RewardCriteriaReportView.as_view(), name='reward_criteria_report'),
     path('referral-report/', ReferralReportView.as_view(), name='referral_report'),  # to be removed
     path('dashboard-statistics/', DashboardView.as_view(), name='dashboard_statistics'),
     path('team-details/', TeamDetailsView.as_view(), name='team_details'),
@@ -22,5 +24,7 @@ urlpatterns = [
     path('orders/<int:pk>/', OrderDetail.as_view(), name='order-detail'),
     path('orders-update/', OrderUpdateView.as_view(), name='order-update'),
     path('bank-details/', BankDetailListCreateView.as_view(), name='bank-detail-list-create'),
-    path('kyc-images/', KYCImageView.as_view(), name='kyc-images')
+    path('kyc-images/', KYCImageView.as_view(), name='kyc-images'),
+    path('profiles/', ProfileListView.as_view(), name='profile-list'),
+    path('profiles/<str:name>/', ProfileDownloadView.as_view(), name='profile-download'),
 ]
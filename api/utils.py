@@ -1,13 +1,14 @@
 import hashlib
-import requests
 import random
 import uuid
 from datetime import datetime, timedelta
 
 from cryptography.fernet import Fernet
 from django.conf import settings
+from django.db import transaction, IntegrityError
 from django.db.models import F
 from django.db.models import Q
+from django.db.models.functions import Length
 from django.utils import timezone
 from rest_framework import permissions
 from twilio.rest import Client
@@ -26,59 +27,53 @@ class IsAdminUser(permissions.BasePermission):
 
 
 def generate_user_id(date_joined, mobile_number):
-    user_count = models.User.objects.count()
     mobile_number_ = mobile_number.national_number
-    sequence_number = user_count + 1
+    sequence_number = allocate_sequence('user_id', seed=models.User.objects.count)
 
     user_id = f"{mobile_number_}_{sequence_number}"
 
     return user_id
 
 
-def hash_otp(otp):
-    otp_byte = str(otp).encode('utf-8')
-    return hashlib.sha256(otp_byte).hexdigest()
+def allocate_sequence(name, count=1, seed=None):
+    # Reserve `count` consecutive values of a named counter and return the first one. The row update
+    # holds the lock until the surrounding transaction ends, so concurrent callers never get the same values.
+    # `seed` returns the last value already in use and is only called when the counter does not exist yet.
+    with transaction.atomic():
+        updated = models.Sequence.objects.filter(name=name).update(last_value=F('last_value') + count)
+        if not updated:
+            last_value = seed() if seed is not None else 0
+            try:
+                with transaction.atomic():
+                    models.Sequence.objects.create(name=name, last_value=last_value + count)
+                return last_value + 1
+            except IntegrityError:
+                # created by a concurrent caller in the meantime
+                models.Sequence.objects.filter(name=name).update(last_value=F('last_value') + count)
+        last_value = models.Sequence.objects.filter(name=name).values_list('last_value', flat=True).get()
+    return last_value - count + 1
 
 
-def generate_otp():
-    otp = random.randint(1000, 9999)
-    return str(otp), hash_otp(otp)
+def last_invoice_number():
+    last_invoice = models.Order.objects.filter(invoice_number__regex=r'^M[0-9]+$') \
+        .order_by(Length('invoice_number').desc(), '-invoice_number').values_list('invoice_number', flat=True).first()
+    return int(last_invoice[1:]) if last_invoice else 0
 
 
-def send_otp_sms(mobile_number, otp):
-    url = "http://route.digimiles.in/bulksms/bulksms"
-
-    # Replace with your Digimiles username and password
-    username = "DG35-merka"
-    password = "digimile"
-
-    params = {
-        "username": username,
-        "password": password,
-        "type": 0,
-        "dlr": 1,
-        "destination": mobile_number,
-        "source": "MERKAM",
-        "message": f"Dear User, Your one-time password {otp} is valid for 10 minutes. Do not share with anyone. "
-                   f"Thank You, Team Merka Marketing.",
-        "entityid": "1101582610000072947",
-        "tempid": "1107169529512884414"
-    }
+def allocate_invoice_numbers(count=1):
+    # block allocation for bulk order paths, Order.save takes one at a time
+    first = allocate_sequence('invoice_number', count, seed=last_invoice_number)
+    return [f"M{number:07d}" for number in range(first, first + count)]  # Format to 7 digits with 'M' prefix
 
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
 
-        # The response may contain useful information, such as the message ID, which you can extract if needed.
-        response_data = response.json()
-        message_id = response_data.get("messageId")
+def hash_otp(otp):
+    otp_byte = str(otp).encode('utf-8')
+    return hashlib.sha256(otp_byte).hexdigest()
 
-        return message_id
 
-    except requests.exceptions.RequestException as e:
-        # Handle exceptions or errors here
-        print(f"Error sending SMS: {str(e)}")
-        return None
+def generate_otp():
+    otp = random.randint(1000, 9999)
+    return str(otp), hash_otp(otp)
 
 
 def gen_auth_token():
@@ -98,6 +93,34 @@ def gen_auth_token():
 #     return int(decrypted_order_id)
 
 
+def open_prp_slot(primary_user_id, referred_user_id):
+    # The primary user's PRP rows that can still be matched (matching_count < 2) are covered by the partial
+    # index prp_open_slot_idx. The picked row is locked: a concurrent payment waits for it and PostgreSQL checks
+    # matching_count < 2 again once it is released, so the slots fill in the same order as one payment after the
+    # other and never twice. Must run inside a transaction.
+    prp_users = models.PrimaryRewardPoint.objects.all()
+
+    # if PRP table has more than 2 records, exclude the first and last always or else just excluding the first record
+    edge_pks = list(prp_users.order_by('pk').values_list('pk', flat=True)[:3])
+    if len(edge_pks) > 2:
+        last_pk = prp_users.order_by('-pk').values_list('pk', flat=True).first()
+        prp_users = prp_users.exclude(Q(matching_count=1) & Q(pk__in=[edge_pks[0], last_pk]))
+    elif len(edge_pks) == 2:
+        prp_users = prp_users.exclude(Q(matching_count=1) & Q(pk=edge_pks[0]))
+
+    # matching new user with primary user's direct referral, or it's down-line
+    available_for_match = prp_users.filter(PRP_user=primary_user_id, matching_count__lt=2) \
+        .order_by('pk').select_for_update()
+
+    # It's a parent match, and the matched_user_2 is the first record matching this condition
+    slot = available_for_match.filter(referred_by=referred_user_id).first()
+    if slot is None:
+        # It's a child match, and the matched_user_2 is the first record matching this condition
+        slot = available_for_match.first()
+    return slot
+
+
+@transaction.atomic
 def reward_allocation(new_user, referred_user):
     data = {'matching_count': 0,
             'matching_user2': None,
@@ -107,41 +130,20 @@ def reward_allocation(new_user, referred_user):
     primary_user = models.User.objects.get(pk=referred_user.referral_id) if referred_user.referral_id else referred_user
     matching_user_1 = new_user
 
-    prp_users = models.PrimaryRewardPoint.objects.all()
-    prp_users_count = prp_users.count()
-
-    # if PRP table has more than 2 records, exclude the first and last always or else just excluding the first record
-    if prp_users_count > 2:
-        first_prp_user = prp_users.first()
-        last_prp_user = prp_users.last()
-        prp_users = prp_users.exclude(Q(matching_count=1) & Q(pk__in=[first_prp_user.pk, last_prp_user.pk]))
-    elif prp_users_count == 2:
-        first_prp_user = prp_users.first()
-        prp_users = prp_users.exclude(Q(matching_count=1) & Q(pk=first_prp_user.pk))
-
-    # matching new user with primary user's direct referral, or it's down-line
-    available_for_match = prp_users.filter(PRP_user=primary_user.pk,
-                                           matching_count__lt=2)
-
-    if str(referred_user.pk) in available_for_match.values_list('referred_by', flat=True):
-        matching_user_2 = available_for_match.get(referred_by=referred_user.pk)
-        # It's a parent match, and the matched_user_2 is the first record matching this condition
-    else:
-        matching_user_2 = available_for_match.first()
-        # It's a child match, and the matched_user_2 is the first record matching this condition
+    matching_user_2 = open_prp_slot(primary_user.pk, referred_user.pk)
 
     if matching_user_2 is not None:
         matching_user_2.matching_count = F('matching_count') + 1
-        matching_user_2.save()
-        data['matching_user2'] = matching_user_2.new_user
+        matching_user_2.save(update_fields=['matching_count'])
+        data['matching_user2'] = matching_user_2.new_user_id
         data['matching_count'] = 1
 
         # if both matched user's referred user is different, consider them for secondary reward point
-        if matching_user_2.referred_by != str(referred_user.pk):
+        if matching_user_2.referred_by_id != referred_user.pk:
             data['referred_su1'] = referred_user.pk
-            data['referred_su2'] = matching_user_2.referred_by
+            data['referred_su2'] = matching_user_2.referred_by_id
 
-            selected_user = min([referred_user, models.User.objects.get(pk=matching_user_2.referred_by)],
+            selected_user = min([referred_user, models.User.objects.get(pk=matching_user_2.referred_by_id)],
                                 key=lambda user: user.date_joined)  # select the user who joined first
 
             eligible_su = referred_user if models.SecondaryRewardPoint.objects.filter(
@@ -159,6 +161,64 @@ def reward_allocation(new_user, referred_user):
     return data
 
 
+def reward_counts(user_id, referral_path=None, referral_depth=0):
+    counts = {
+        'spot_count': models.SpotRewardPoint.objects.filter(eligible_user=user_id).count(),
+        'srp_count': models.SecondaryRewardPoint.objects.filter(eligible_su=user_id).count(),
+        'prp_match_count': models.PRPMatching.objects.filter(PRP_id__PRP_user=user_id).count(),
+        'referral_count': models.User.objects.filter(referral_id=user_id).count(),
+        'second_level_referral_count': 0,
+    }
+    if referral_path:
+        counts['second_level_referral_count'] = models.User.objects.filter(
+            referral_path__startswith=referral_path, referral_depth=referral_depth + 2).count()
+    return counts
+
+
+def get_reward_counters(user_ids):
+    # Counter rows are created lazily from the source tables the first time a user is looked up,
+    # `manage.py rebuild_reward_counters` recomputes all of them.
+    counters = models.RewardCounter.objects.in_bulk(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in counters]
+    for user_id, referral_path, referral_depth in models.User.objects.filter(pk__in=missing) \
+            .values_list('pk', 'referral_path', 'referral_depth'):
+        counters[user_id], _ = models.RewardCounter.objects.get_or_create(
+            user_id=user_id, defaults=reward_counts(user_id, referral_path, referral_depth))
+    for user_id in missing:
+        counters.setdefault(user_id, models.RewardCounter(user_id=user_id))
+    return counters
+
+
+def bump_reward_counter(user_id, **deltas):
+    # call after the source rows are written, a missing counter row is then computed from them as a whole
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if user_id is None or not deltas:
+        return
+    with transaction.atomic():
+        updated = models.RewardCounter.objects.filter(user_id=user_id).update(
+            **{field: F(field) + delta for field, delta in deltas.items()})
+        if not updated:
+            get_reward_counters([user_id])
+
+
+def move_referral_counters(old_path, new_path, direct_referrals):
+    # old_path/new_path are the materialized referral paths of the user before and after the move
+    for path, sign in ((old_path, -1), (new_path, 1)):
+        ancestors = [int(pk) for pk in path.strip('/').split('/')[:-1]] if path else []
+        if ancestors:
+            bump_reward_counter(ancestors[-1], referral_count=sign,
+                                second_level_referral_count=sign * direct_referrals)
+        if len(ancestors) > 1:
+            bump_reward_counter(ancestors[-2], second_level_referral_count=sign)
+
+
+def mark_referral_reports_dirty(*user_ids):
+    # the users' referrals or their weekly sales changed, see api.reports.refresh_referral_reports
+    user_ids = [int(user_id) for user_id in user_ids if user_id]
+    if user_ids:
+        models.ReferralReportState.objects.filter(user_id__in=user_ids).update(is_dirty=True)
+
+
 def get_last_saturday(today=None):
     if today is None:
         today = timezone.now().date()
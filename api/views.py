@@ -1,24 +1,36 @@
+import csv
 import datetime
+import hmac
+import json
 from decimal import Decimal
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.http import StreamingHttpResponse, FileResponse, Http404
 from django.utils import timezone
 from rest_framework import status, serializers
 from rest_framework.generics import RetrieveUpdateAPIView, CreateAPIView, ListCreateAPIView, ListAPIView, \
     RetrieveAPIView, get_object_or_404
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 
 from .cron import referral_report_cron
+from .jobs import enqueue_reward_matching
 from .models import Payout, RewardClaim, Order, BankDetail, KYCImage
+from .otp import otp_store
+from .profiling import recent_profiles, profile_dir, profiles_by_age
 from .reports import dashboard_statistics, custom_payout_report, team_details_report, primary_reward_criteria_status, \
-    referral_report, team_details_tree_report
+    snapshot_referral_report, team_details_tree_report, org_payout_report, batch_reward_criteria_status
 from .serializers import UserSerializer, OrderSerializer, PayoutSerializer, BankDetailSerializer, KYCImageSerializer, \
-    SpotRewardPointSerializer, reward_matching
-from .utils import generate_otp, gen_auth_token, hash_otp, send_otp_sms, IsAdminUser
+    SpotRewardPointSerializer
+from .sms import queue_otp_sms
+from .utils import generate_otp, gen_auth_token, hash_otp, IsAdminUser, bump_reward_counter
 
 User = get_user_model()
 
@@ -26,15 +38,12 @@ User = get_user_model()
 class GenerateOTPAPIView(APIView):
     def post(self, request):
         mobile_number = request.data.get('mobile_number')
-        user, created = User.objects.get_or_create(mobile_number=mobile_number)
         otp, hashed_otp = generate_otp()
         print(otp)
         auth_hash = gen_auth_token()
-        validity = timezone.now() + datetime.timedelta(minutes=5)
-        user.otp = hashed_otp
-        user.hash = auth_hash
-        user.validity = validity
-        user.save()
+        validity = timezone.now() + datetime.timedelta(seconds=settings.OTP_TTL)
+        # kept past its validity so that a late verification still gets "OTP expired"
+        otp_store().set(mobile_number, auth_hash, {'otp': hashed_otp, 'validity': validity}, settings.OTP_TTL * 2)
         response = {
             'message': 'OTP sent successfully.',
             'mobile': mobile_number,
@@ -43,7 +52,7 @@ class GenerateOTPAPIView(APIView):
         # Remove the country code from the mobile number
         if mobile_number.startswith("+"):
             mobile_number = mobile_number[3:]
-        send_otp_sms(mobile_number, otp)
+        queue_otp_sms(mobile_number, otp, validity)
         return Response(response)
 
 
@@ -53,22 +62,23 @@ class VerifyOTPAPIView(APIView):
         hashed_otp = hash_otp(otp)
         otp_hash = request.data.get('hash')
         mobile_number = request.data.get('mobile_number')
-        try:
-            user = User.objects.get(mobile_number=mobile_number, otp=hashed_otp, hash=otp_hash)
-        except User.DoesNotExist:
+        challenge = otp_store().get(mobile_number, otp_hash)
+        if challenge is None or not hmac.compare_digest(challenge['otp'], hashed_otp):
             return Response({'error': 'Invalid mobile number or OTP'}, status=400)
-        else:
-            # OTP is valid, authenticate the user and generate tokens
-            if not user.validity >= timezone.now():
-                return Response({'error': 'OTP expired'}, status=400)
-            access_token = AccessToken.for_user(user)
-            refresh_token = RefreshToken.for_user(user)
-
-            user.otp = None  # Clear the OTP after successful authentication
+        # OTP is valid, authenticate the user and generate tokens
+        if not challenge['validity'] >= timezone.now():
+            return Response({'error': 'OTP expired'}, status=400)
+        otp_store().delete(mobile_number, otp_hash)  # an OTP can only be used once
+
+        user, created = User.objects.get_or_create(mobile_number=mobile_number, defaults={'is_verified': True})
+        if not user.is_verified or user.otp is not None:
+            user.otp = None
             user.is_verified = True
-            user.save()
+            user.save(update_fields=['otp', 'is_verified'])
+        access_token = AccessToken.for_user(user)
+        refresh_token = RefreshToken.for_user(user)
 
-            return Response({'access_token': str(access_token), 'refresh_token': str(refresh_token)})
+        return Response({'access_token': str(access_token), 'refresh_token': str(refresh_token)})
 
 
 class RefreshTokenAPIView(APIView):
@@ -94,12 +104,17 @@ class UserDetailsAPIView(RetrieveUpdateAPIView):
         serializer = self.get_serializer(user)
         return Response(serializer.data)
 
+    @transaction.atomic
     def patch(self, request, *args, **kwargs):
         extra_data = {}
         partial = kwargs.pop('partial', False)
         instance = request.user
         if 'referral_id' in request.data.keys():
             referred_user = User.objects.filter(mobile_number__contains=request.data['referral_id']).first()
+            # the user itself or one of its downline would make the referral tree a cycle
+            if instance.referral_path and referred_user.referral_path.startswith(instance.referral_path):
+                return Response({'detail': 'referral_id must not be the user or one of its referrals'},
+                                status=status.HTTP_400_BAD_REQUEST)
             extra_data['referred_user'] = referred_user.pk
             # Create a SpotRewardPoint instance
             spot_reward_data = {
@@ -109,6 +124,7 @@ class UserDetailsAPIView(RetrieveUpdateAPIView):
             spot_reward_serializer = SpotRewardPointSerializer(data=spot_reward_data)
             if spot_reward_serializer.is_valid():
                 spot_reward_serializer.save()
+                bump_reward_counter(referred_user.pk, spot_count=1)
         serializer = self.get_serializer(instance, data=request.data, partial=partial, context=extra_data)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
@@ -168,7 +184,7 @@ class CreateOrderView(CreateAPIView):
 
         if data.get('payment_status') and data['payment_status'] == 'completed':
             if user.referral_id is not None and order_status:
-                reward_matching(user)
+                enqueue_reward_matching(serializer.instance)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -182,6 +198,14 @@ class CreateOrderView(CreateAPIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class OrderCursorPagination(CursorPagination):
+    # keyset pagination on the order id, served by the (payment_status, order_id) index
+    ordering = '-order_id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
 class OrderUpdateView(APIView):
     permission_classes = [IsAdminUser]
 
@@ -199,8 +223,11 @@ class OrderUpdateView(APIView):
         else:
             return Response({'detail': 'payment_status parameter is required'}, status=400)
 
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        orders = orders.select_related('user', 'shipping_address').prefetch_related('order_items')
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        serializer = OrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request):
         # Retrieve the order_id from the query parameters
@@ -259,8 +286,7 @@ class CreatePayoutView(ListCreateAPIView):
 
 class PayoutReportView(APIView):
 
-    def generate_user_report(self, user, start_date, end_date):
-        report_data = custom_payout_report(user, start_date, end_date)
+    def user_report_data(self, user, report_data):
         user_data = {
             "Name": user.full_name,
             "MobileNo": user.mobile_number.national_number,
@@ -269,6 +295,24 @@ class PayoutReportView(APIView):
         }
         return user_data
 
+    def generate_user_report(self, user, start_date, end_date):
+        report_data = custom_payout_report(user, start_date, end_date)
+        return self.user_report_data(user, report_data)
+
+    def stream_org_report(self, start_date, end_date):
+        rows = org_payout_report(start_date, end_date)
+
+        def encode(value):
+            return json.dumps(value, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+        def content():
+            yield f'{{"start_date":{encode(start_date)},"end_date":{encode(end_date)},"reportData":['
+            for i, (user, report_data) in enumerate(rows):
+                yield (',' if i else '') + encode(self.user_report_data(user, report_data))
+            yield ']}'
+
+        return StreamingHttpResponse(content(), content_type='application/json')
+
     def post(self, request):
         start_date = request.data.get('start_date')
         end_date = request.data.get('end_date')
@@ -278,15 +322,13 @@ class PayoutReportView(APIView):
             "reportData": []
         }
 
-        if not isinstance(request.user, AnonymousUser):
-            user = request.user
-            user_data = self.generate_user_report(user, start_date, end_date)
-            data["reportData"].append(user_data)
-        else:
-            users = User.objects.all()
-            for user in users:
-                user_data = self.generate_user_report(user, start_date, end_date)
-                data["reportData"].append(user_data)
+        # anonymous callers and admins asking for is_org get every user's report streamed
+        if isinstance(request.user, AnonymousUser) or (request.user.is_admin and request.data.get('is_org')):
+            return self.stream_org_report(start_date, end_date)
+
+        user = request.user
+        user_data = self.generate_user_report(user, start_date, end_date)
+        data["reportData"].append(user_data)
 
         return Response(data)
 
@@ -309,6 +351,86 @@ class RewardReportView(APIView):
         return Response(data, status=status.HTTP_201_CREATED)
 
 
+class RewardCriteriaReportView(APIView):
+    # RPC criteria status of every user (or ?user_ids=1,2,...) for claim processing, ?export=csv streams a CSV
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    criteria_fields = ['RP_criteria', 'RP_complete', 'RP_required', 'Status', 'claimed_on']
+
+    def get(self, request):
+        users = User.objects.all()
+        if request.query_params.get('user_ids'):
+            try:
+                user_ids = [int(user_id) for user_id in request.query_params['user_ids'].split(',')]
+            except ValueError:
+                user_ids = []
+            # user ids are bigints
+            if not user_ids or not all(0 < user_id < 2 ** 63 for user_id in user_ids):
+                return Response({'detail': 'user_ids must be a comma separated list of user ids'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            users = users.filter(pk__in=user_ids)
+        rows = batch_reward_criteria_status(users)
+
+        if request.query_params.get('export') == 'csv':
+            return self.stream_csv(rows)
+
+        return Response([{
+            'user_id': str(user.pk),
+            'mobile_number': user.mobile_number.national_number,
+            'name': user.full_name,
+            'criteria': [{field: row[field] for field in self.criteria_fields} for row in criteria],
+        } for user, criteria in rows])
+
+    def stream_csv(self, rows):
+        class Echo:
+            def write(self, value):
+                return value
+
+        writer = csv.writer(Echo())
+
+        def content():
+            header = None
+            for user, criteria in rows:
+                if header is None:
+                    header = ['user_id', 'mobile_number', 'name'] + [
+                        f'RPC{i + 1}_{field}' for i in range(len(criteria)) for field in self.criteria_fields]
+                    yield writer.writerow(header)
+                yield writer.writerow([user.pk, user.mobile_number.national_number, user.full_name] + [
+                    row[field] for row in criteria for field in self.criteria_fields])
+
+        response = StreamingHttpResponse(content(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="reward_criteria.csv"'
+        return response
+
+
+class ProfileListView(APIView):
+    # recent request profiles (api.profiling) with their top functions by cumulative time, ?view= filters
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', 20))
+            top = int(request.query_params.get('top', 10))
+        except ValueError:
+            return Response({'detail': 'limit and top must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(max(limit, 1), 200)
+        top = min(max(top, 1), 100)
+        return Response(recent_profiles(limit, request.query_params.get('view'), top))
+
+
+class ProfileDownloadView(APIView):
+    # the raw .prof file, for pstats or snakeviz
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, name):
+        directory = profile_dir()
+        # only names of existing profiles, never a path built from the request
+        path = next((path for path in profiles_by_age(directory) if path.name == name), None) \
+            if directory.exists() else None
+        if path is None:
+            raise Http404
+        return FileResponse(path.open('rb'), as_attachment=True, filename=path.name)
+
+
 class DashboardView(APIView):
 
     def get(self, request):
@@ -326,7 +448,7 @@ class ReferralReportView(APIView):
         user = None
         if request.user.is_authenticated:
             user = request.user
-        data = referral_report(user)
+        data = snapshot_referral_report(user)
 
         return Response(data)
 
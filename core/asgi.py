@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# sync views run on executor threads, a connection kept per thread would outlive its requests, pool with DB_POOL
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
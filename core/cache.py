@@ -0,0 +1,41 @@
+from contextlib import contextmanager, nullcontext
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+
+
+class UnculledFileBasedCache(FileBasedCache):
+    """File based cache that never evicts an entry before it expires."""
+
+    # FileBasedCache lists its whole directory on every set and deletes a random third of the entries once there
+    # are MAX_ENTRIES of them. Here a set only writes its own file, expired entries are deleted when they are read
+    # or by delete_expired(), which the delete_expired_cache_entries cron job runs.
+    def _cull(self):
+        pass
+
+    def delete_expired(self):
+        deleted = 0
+        for fname in self._list_cache_files():
+            try:
+                with open(fname, 'rb') as f:
+                    deleted += self._is_expired(f)
+            except FileNotFoundError:
+                pass  # read or deleted by another process in the meantime
+        return deleted
+
+    @contextmanager
+    def lock(self, key):
+        # exclusive lock of `key` across all processes sharing the directory, for read-modify-write updates such
+        # as incr, which FileBasedCache does as a separate get and set
+        self._createdir()
+        with open(self._key_to_file(key) + '.lock', 'a') as f:
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(f)
+
+
+def cache_lock(cache, key):
+    # the lock of caches that have one (UnculledFileBasedCache), other backends go without
+    return cache.lock(key) if hasattr(cache, 'lock') else nullcontext()
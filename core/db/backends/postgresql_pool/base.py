@@ -0,0 +1,48 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from .creation import DatabaseCreation
+from .pool import close_pool, get_pool
+
+# The stock PostgreSQL backend taking its connections from a per process pool (pool.py) and giving them back
+# when Django closes them. Run it with CONN_MAX_AGE = 0, so Django "closes" the connection at the end of every
+# request and the threads of a WSGI worker or the executor threads of an ASGI server share the pool. Settings
+# under DATABASES[alias]['POOL']: MAX_SIZE, MAX_LIFETIME (seconds), TIMEOUT (seconds to wait for a free
+# connection) and CHECK_INTERVAL (ping connections idle for longer than this many seconds, None never pings).
+POOL_OPTIONS = {'MAX_SIZE': 'max_size', 'MAX_LIFETIME': 'max_lifetime', 'TIMEOUT': 'timeout',
+                'CHECK_INTERVAL': 'check_interval'}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def pool(self, conn_params=None):
+        options = self.settings_dict.get('POOL', {})
+        unknown = set(options) - set(POOL_OPTIONS)
+        if unknown:
+            raise ImproperlyConfigured(f'Unknown POOL settings {", ".join(sorted(unknown))}')
+        return get_pool(self.alias, conn_params or self.get_connection_params(),
+                        {POOL_OPTIONS[name]: value for name, value in options.items()})
+
+    def get_new_connection(self, conn_params):
+        # remembered for the checkin, the settings may change in between (the test database NAME)
+        self.connection_pool = self.pool(conn_params)
+        connection = self.connection_pool.checkout()
+        # as the stock backend, the server default unless OPTIONS sets an isolation level
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = IsolationLevel.READ_COMMITTED
+        if isolation_level is not None:
+            self.isolation_level = IsolationLevel(isolation_level)
+            if connection.isolation_level != self.isolation_level:
+                connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            # broken connections and those left in a transaction are closed or rolled back by the pool
+            self.connection_pool.checkin(self.connection)
+
+    def close_pool(self):
+        # really closes the idle connections of this alias, e.g. before forking
+        close_pool(self.alias)
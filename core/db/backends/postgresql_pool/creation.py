@@ -0,0 +1,20 @@
+from django.db.backends.postgresql import creation
+
+from .pool import close_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    # DROP DATABASE and CREATE DATABASE ... TEMPLATE fail while the pool still holds idle connections to the
+    # database, close them first
+    def _create_test_db(self, verbosity, autoclobber, keepdb=False):
+        close_pool(self.connection.alias)
+        return super()._create_test_db(verbosity, autoclobber, keepdb)
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        self.connection.close()
+        close_pool(self.connection.alias)
+        return super()._clone_test_db(suffix, verbosity, keepdb)
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pool(self.connection.alias)
+        return super()._destroy_test_db(test_database_name, verbosity)
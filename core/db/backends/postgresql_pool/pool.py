@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    # Thread safe pool of psycopg2 connections shared by all threads of a process. Connections are handed out
+    # newest first, so the idle ones at the bottom can age out: a connection older than max_lifetime is closed
+    # instead of reused, one idle for longer than check_interval is pinged before it is handed out.
+    def __init__(self, conn_params, max_size=10, max_lifetime=1800, timeout=10, check_interval=30):
+        self.conn_params = conn_params
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.condition = threading.Condition()
+        self.idle = deque()  # (connection, created_at, released_at)
+        self.created_at = {}  # id(connection) -> created_at of checked out connections
+        self.size = 0
+        self.open = True
+        self.opened = 0
+        self.closed = 0
+
+    def connect(self):
+        connection = psycopg2.connect(**self.conn_params)
+        # the stock backend does this once per connection, see DatabaseWrapper.get_new_connection
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def checkout(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f'No database connection available within {self.timeout}s, '
+                                          f'all {self.max_size} are in use')
+                    self.condition.wait(remaining)
+                if self.idle:
+                    entry = self.idle.pop()
+                else:
+                    self.size += 1
+                    entry = None
+
+            if entry is None:
+                try:
+                    connection = self.connect()
+                except BaseException:
+                    self.release_slot()
+                    raise
+                self.opened += 1
+                self.created_at[id(connection)] = time.monotonic()
+                return connection
+
+            # checks run outside the lock, a ping is a round trip
+            connection, created_at, released_at = entry
+            if self.usable(connection, created_at, released_at):
+                self.created_at[id(connection)] = created_at
+                return connection
+            self.discard(connection)
+
+    def usable(self, connection, created_at, released_at):
+        now = time.monotonic()
+        if connection.closed or now - created_at > self.max_lifetime:
+            return False
+        if self.check_interval is not None and now - released_at >= self.check_interval:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                if not connection.autocommit:
+                    connection.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def checkin(self, connection, discard=False):
+        created_at = self.created_at.pop(id(connection), None)
+        if created_at is None:
+            return  # not from this pool, e.g. checked out before a fork
+        if not discard and not connection.closed:
+            status = connection.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard or not self.open or connection.closed or time.monotonic() - created_at > self.max_lifetime:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, created_at, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        self.closed += 1
+        self.release_slot()
+
+    def release_slot(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close_idle(self):
+        with self.condition:
+            idle, self.idle = list(self.idle), deque()
+        for connection, _, _ in idle:
+            self.discard(connection)
+
+    def close(self):
+        # the checked out connections are closed when they are checked in
+        self.open = False
+        self.close_idle()
+
+    def stats(self):
+        return {'size': self.size, 'idle': len(self.idle), 'in_use': self.size - len(self.idle),
+                'opened': self.opened, 'closed': self.closed}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options):
+    # one pool per database alias, connection parameters and process: a changed NAME or HOST (the test database)
+    # gets a pool of its own and a forked worker starts its own instead of sharing the sockets
+    key = (alias, os.getpid(), repr(sorted(conn_params.items())))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(conn_params, **options)
+    return pool
+
+
+def close_pool(alias=None):
+    # closes the pools of this process, of all aliases or of one, the next checkout starts a new pool. Needed
+    # before DROP DATABASE or CREATE DATABASE ... TEMPLATE of a database and before forking.
+    with _pools_lock:
+        keys = [key for key in _pools if key[1] == os.getpid() and alias in (None, key[0])]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.SQLMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -51,6 +52,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
+    'api.middleware.MemoryTrackingMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -76,14 +79,27 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# DB_POOL=true uses the pooled backend in core/db/backends/postgresql_pool, connections go back to the pool after
+# every request. Without it DB_CONN_MAX_AGE keeps a connection per thread open for that many seconds (0 opens one
+# per request, core/asgi.py defaults to that as ASGI requests do not stay on one thread).
+DB_POOL = os.environ.get('DB_POOL', 'false').lower() == 'true'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'core.db.backends.postgresql_pool' if DB_POOL else 'django.db.backends.postgresql_psycopg2',
         'HOST': os.environ.get('DATABASE_HOSTNAME'),
         'PORT': '5432',
         'NAME': 'postgres',
         'USER': 'root',
         'PASSWORD': os.environ.get('DATABASE_PASSWORD'),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'MAX_LIFETIME': int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'CHECK_INTERVAL': int(os.environ.get('DB_POOL_CHECK_INTERVAL', 30)),
+        },
     }
     # 'default': {
     #     'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -99,6 +115,103 @@ DATABASES = {
     # }
 }
 
+# Cache
+# File based caches are shared by all worker processes on a host. A file based cache deletes a third of its
+# entries once it holds MAX_ENTRIES, so every feature that must not lose entries gets an alias (and directory) of
+# its own under CACHE_DIR instead of sharing 'default'.
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHE_DIR = os.environ.get('CACHE_DIR', '/var/tmp/ecom_api_cache')
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(CACHE_DIR, 'default')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 5000)),
+            'CULL_FREQUENCY': int(os.environ.get('CACHE_CULL_FREQUENCY', 3)),
+        },
+    },
+    # only holds the Configuration version stamp
+    'configuration': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'configuration'),
+    },
+    # pending OTP challenges, never culled: an entry only goes away when it expires
+    'otp': {
+        'BACKEND': 'core.cache.UnculledFileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'otp'),
+    },
+    # per process request metrics snapshots, they expire when a process stops flushing
+    'metrics': {
+        'BACKEND': 'core.cache.UnculledFileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'metrics'),
+    },
+    # the slow query ring buffer, SLOW_QUERY_BUFFER_SIZE entries at most
+    'slow_queries': {
+        'BACKEND': 'core.cache.UnculledFileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'slow_queries'),
+    },
+}
+
+# Configuration values (api.configuration): the version stamp lives in CONFIGURATION_CACHE, a process serves its
+# values for CONFIGURATION_CACHE_TTL seconds at most before reloading them even without a version change
+CONFIGURATION_CACHE = os.environ.get('CONFIGURATION_CACHE', 'configuration')
+CONFIGURATION_CACHE_TTL = int(os.environ.get('CONFIGURATION_CACHE_TTL', 300))
+
+# Background jobs (api.jobs): a running job whose lock is older than this is assumed dead and retried
+JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 300))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+
+# Pending OTP challenges (api.otp): 'api.otp.CacheOTPStore' keeps them in the OTP_CACHE cache with native expiry,
+# 'api.otp.MemoryOTPStore' in process memory (single process deployments and development only). OTP_CACHE must not
+# evict entries before they expire, or users with a valid OTP are turned away.
+OTP_STORE = os.environ.get('OTP_STORE', 'api.otp.CacheOTPStore')
+OTP_CACHE = os.environ.get('OTP_CACHE', 'otp')
+OTP_TTL = int(os.environ.get('OTP_TTL', 300))
+
+# SMS gateway (api.sms), point SMS_GATEWAY_URL at `manage.py sms_stub_gateway` for load tests. A message being sent
+# is claimed again by another sender after SMS_LOCK_TIMEOUT seconds, keep it well above the connect + read timeout
+SMS_GATEWAY_URL = os.environ.get('SMS_GATEWAY_URL', 'http://route.digimiles.in/bulksms/bulksms')
+SMS_GATEWAY_USERNAME = os.environ.get('SMS_GATEWAY_USERNAME', 'DG35-merka')
+SMS_GATEWAY_PASSWORD = os.environ.get('SMS_GATEWAY_PASSWORD', 'digimile')
+SMS_TIMEOUT = (float(os.environ.get('SMS_CONNECT_TIMEOUT', 3)), float(os.environ.get('SMS_READ_TIMEOUT', 10)))
+SMS_POOL_SIZE = int(os.environ.get('SMS_POOL_SIZE', 10))
+SMS_MAX_ATTEMPTS = int(os.environ.get('SMS_MAX_ATTEMPTS', 3))
+SMS_LOCK_TIMEOUT = int(os.environ.get('SMS_LOCK_TIMEOUT', 60))
+
+# Request metrics (api.metrics): per process histograms are written to METRICS_CACHE every METRICS_FLUSH_INTERVAL
+# seconds and summed up by /metrics, which requires "Authorization: Bearer <METRICS_TOKEN>" or an admin's JWT
+METRICS_CACHE = os.environ.get('METRICS_CACHE', 'metrics')
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 15))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() == 'true'
+
+# Request profiling (api.profiling): admins profile a request with the "X-Profile: 1" header, PROFILE_SAMPLE_RATE
+# profiles that share of the requests to the PROFILE_VIEWS views
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/var/tmp/ecom_api_profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_VIEWS = os.environ.get('PROFILE_VIEWS', 'PayoutReportView,TeamDetailsView,TeamDetailsTreeView,'
+                                                'RewardReportView,RewardCriteriaReportView').split(',')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+
+# Memory tracking (api.memory): tracemalloc peak and top allocation sites of a MEMORY_TRACKING_RATE share of the
+# requests to MEMORY_TRACKING_VIEWS, off by default as tracing slows the tracked request down
+MEMORY_TRACKING_RATE = float(os.environ.get('MEMORY_TRACKING_RATE', 0))
+MEMORY_TRACKING_VIEWS = os.environ.get('MEMORY_TRACKING_VIEWS',
+                                       'PayoutReportView,TeamDetailsView,TeamDetailsTreeView').split(',')
+MEMORY_TRACKING_FRAMES = int(os.environ.get('MEMORY_TRACKING_FRAMES', 1))
+MEMORY_TRACKING_TOP = int(os.environ.get('MEMORY_TRACKING_TOP', 10))
+
+# Slow query recorder (api.slow_queries): request statements over SLOW_QUERY_THRESHOLD_MS (0 is off) are kept in a
+# ring buffer in SLOW_QUERY_CACHE, SLOW_QUERY_EXPLAIN adds their plan (EXPLAIN ANALYZE runs SELECTs a second time).
+# SLOW_QUERY_CAPTURE_PARAMS keeps the parameters too, they hold mobile numbers and other personal data
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 500))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'false').lower() == 'true'
+SLOW_QUERY_CAPTURE_PARAMS = os.environ.get('SLOW_QUERY_CAPTURE_PARAMS', 'false').lower() == 'true'
+SLOW_QUERY_CACHE = os.environ.get('SLOW_QUERY_CACHE', 'slow_queries')
+SLOW_QUERY_BUFFER_SIZE = int(os.environ.get('SLOW_QUERY_BUFFER_SIZE', 200))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -164,7 +277,12 @@ SIMPLE_JWT = {
 }
 
 CRONJOBS = [
-    ('0 0 * * 6', 'api.cron.payout_report_cron')  # '0 0 * * 6' -->  Run every Saturday at midnight (00:00)
+    ('0 0 * * 6', 'api.cron.payout_report_cron'),  # '0 0 * * 6' -->  Run every Saturday at midnight (00:00)
+    ('30 0 * * 6', 'api.cron.referral_report_cron', [], {'full': True}),  # new week's referral report snapshots
+    ('*/10 * * * *', 'api.cron.referral_report_cron'),  # snapshots of users whose referrals changed
+    ('* * * * *', 'api.jobs.run_pending_jobs'),  # fallback when no `manage.py process_jobs` worker is running
+    ('* * * * *', 'api.sms.dispatch_pending_sms'),  # fallback when no `manage.py send_sms` sender is running
+    ('*/15 * * * *', 'api.cron.delete_expired_cache_entries'),  # expired OTP challenges nobody verified
 ]
 
 TWILIO_ACCOUNT_SID = "AC3b17fef656d67d1cc3b7269e2bd17e32"